@@ -0,0 +1,106 @@
+"""Generate synthetic ICEES cohort csvs and a matching features yaml for benchmarking."""
+import argparse
+import csv
+import numpy as np
+from pathlib import Path
+import yaml
+
+
+def get_features(binary_features, enum_features, enum_levels, integer_features, integer_range, curies_per_feature):
+    """Get the features yaml entries of the synthetic features."""
+    features = {}
+    for k in range(binary_features):
+        features[f'Binary{k}'] = {
+            'type': 'string',
+            'enum': ['false', 'true'],
+            'categories': ['biolink:PhenotypicFeature'],
+        }
+    for k in range(enum_features):
+        features[f'Enum{k}'] = {
+            'type': 'string',
+            'enum': [f'level{level}' for level in range(enum_levels)],
+        }
+    for k in range(integer_features):
+        features[f'Integer{k}'] = {
+            'type': 'integer',
+            'minimum': 1,
+            'maximum': integer_range,
+        }
+    for feature, feature_info in features.items():
+        feature_info['name_lookup'] = [{'search_term': feature.lower(), 'limit': curies_per_feature}]
+    return features
+
+
+def get_column_values(feature_info, rows, missing_rate, rng):
+    """Get random csv values for a feature, with missing_rate of them empty."""
+    if feature_info.get('enum'):
+        values = np.array(feature_info['enum'], dtype=object)[rng.integers(0, len(feature_info['enum']), rows)]
+    else:
+        values = rng.integers(feature_info['minimum'], feature_info['maximum'] + 1, rows).astype(str).astype(object)
+    values[rng.random(rows) < missing_rate] = ''
+    return values
+
+
+def generate_cohorts(output_path, rows=10000, cohorts=1, binary_features=20, enum_features=5, enum_levels=4,
+                     integer_features=2, integer_range=90, curies_per_feature=1, missing_rate=0.1, seed=0, dataset_name='bench'):
+    """Write cohort csvs to output_path/data and their features to output_path/features.yaml.
+
+    Returns the paths of the csvs and the features yaml.
+    """
+    output_path = Path(output_path)
+    (output_path / 'data').mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    features = get_features(binary_features, enum_features, enum_levels, integer_features, integer_range, curies_per_feature)
+
+    features_yaml = output_path / 'features.yaml'
+    with open(features_yaml, 'w') as f:
+        yaml.safe_dump({'patient': features}, f)
+
+    data_csvs = []
+    for year in range(2010, 2010 + cohorts):
+        data_csv = output_path / 'data' / f'{dataset_name}_icees_patient_cohort_{year}.csv'
+        columns = [np.arange(rows).astype(str).astype(object)] + [
+            get_column_values(feature_info, rows, missing_rate, rng)
+            for feature_info in features.values()
+        ]
+        with open(data_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['PatientId'] + list(features))
+            writer.writerows(zip(*columns))
+        data_csvs.append(data_csv)
+    return data_csvs, features_yaml
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic ICEES cohort csvs and a matching features yaml.')
+    parser.add_argument('output', help='Folder to write data/*.csv and features.yaml to.')
+    parser.add_argument('--rows', type=int, default=10000, help='Patients per cohort.')
+    parser.add_argument('--cohorts', type=int, default=1, help='Number of cohort years, starting at 2010.')
+    parser.add_argument('--binary-features', type=int, default=20, help='Number of true/false features.')
+    parser.add_argument('--enum-features', type=int, default=5, help='Number of categorical features.')
+    parser.add_argument('--enum-levels', type=int, default=4, help='Levels of each categorical feature.')
+    parser.add_argument('--integer-features', type=int, default=2, help='Number of integer features.')
+    parser.add_argument('--integer-range', type=int, default=90, help='Values of each integer feature, from 1.')
+    parser.add_argument('--curies-per-feature', type=int, default=1, help='Name resolver limit of each feature.')
+    parser.add_argument('--missing-rate', type=float, default=0.1, help='Fraction of empty values.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data_csvs, features_yaml = generate_cohorts(
+        args.output,
+        rows=args.rows,
+        cohorts=args.cohorts,
+        binary_features=args.binary_features,
+        enum_features=args.enum_features,
+        enum_levels=args.enum_levels,
+        integer_features=args.integer_features,
+        integer_range=args.integer_range,
+        curies_per_feature=args.curies_per_feature,
+        missing_rate=args.missing_rate,
+        seed=args.seed,
+    )
+    print(f'Wrote {len(data_csvs)} cohorts and {features_yaml}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Time the stages of an ICEES KG build on synthetic cohorts.
+
+Cohorts are built with main.process_cohort and each stage's time comes from
+their run reports:
+- reading the csvs
+- encoding them
+- counting feature pairs
+- computing pair stats
+- node lookup against local stand-ins for the name resolver and node norm
+- writing the count tables and build files
+- anything else a cohort spends time on
+- massage.py
+
+Results are written as JSON, so runs from different commits can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    git checkout my-branch
+    python benchmarks/run_benchmarks.py --compare before.json
+
+ORION's Common folder has to be importable, as for main.py.
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy
+import yaml
+
+from generate_cohorts import generate_cohorts
+
+REPO_PATH = Path(__file__).parent.parent.resolve()
+ICEES_KG_PATH = REPO_PATH / 'icees_kg'
+STAGES = ['ingest', 'encode', 'pair_counts', 'pair_stats', 'lookup', 'write', 'other', 'massage']
+# The stages of a cohort's run report that make up each benchmark stage
+REPORT_STAGES = {
+    'ingest': ['hash_csv', 'read_csv'],
+    'encode': ['encode_rows'],
+    'pair_counts': ['count_chunks'],
+    'pair_stats': ['pair_stats'],
+    'write': ['save_count_tables', 'filter_pairs', 'write_build'],
+}
+# Bump when the results format or what the stages measure changes
+RESULTS_VERSION = 2
+
+
+def get_free_port():
+    """Get a free local port for the stub services."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub_services(port, latency):
+    """Start the stub services in a subprocess and wait until they accept connections."""
+    process = subprocess.Popen([
+        sys.executable, str(Path(__file__).parent / 'stub_services.py'),
+        '--port', str(port),
+        '--latency', str(latency),
+    ])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('The stub services did not start')
+
+
+def get_git_info():
+    """Get the commit being benchmarked and whether tracked files have changed since."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_PATH, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_PATH, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': bool(status.strip())}
+
+
+def count_lines(path):
+    """Count the lines of a file."""
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def release_version():
+    """Get the release folder massage.py writes to."""
+    import massage
+    return massage.release_version
+
+
+def time_build(repeat_path, data_csvs, features_yaml, pair_workers, massage_workers):
+    """Run a build of the cohorts with main.process_cohort, then massage.py.
+
+    Returns the seconds spent in each stage, from the cohorts' run reports, and
+    counters of what was processed.
+    """
+    # imported here, once the environment points them at the stub services
+    import main
+    from utils import node_lookup
+
+    for folder in ['build', 'run', f'releases/{release_version()}']:
+        (repeat_path / folder).mkdir(parents=True, exist_ok=True)
+    # main.py writes to ../build
+    os.chdir(repeat_path / 'run')
+    # a fresh cache so every lookup goes to the stub services
+    node_lookup.lookup_cache = node_lookup.NodeLookupCache(str(repeat_path / 'node_lookup.sqlite'), node_lookup.cache_ttl)
+
+    stage_seconds = dict.fromkeys(STAGES, 0.0)
+    counters = {'rows': 0, 'features': 0, 'pairs': 0, 'build_pair_records': 0, 'release_edges': 0}
+
+    with open(features_yaml, 'r') as f:
+        features = yaml.safe_load(f)['patient']
+
+    start = time.perf_counter()
+    resolved_nodes = node_lookup.resolve_features(features)
+    stage_seconds['lookup'] += time.perf_counter() - start
+
+    for data_csv in data_csvs:
+        _, report = main.process_cohort(data_csv, features, resolved_nodes, 'bench', 'benchmark', progress=False, pair_workers=pair_workers, clean=True)
+        cohort_seconds = {name: stage['wall_seconds'] for name, stage in report['stages'].items()}
+        for stage, report_stages in REPORT_STAGES.items():
+            stage_seconds[stage] += sum(cohort_seconds.get(name, 0.0) for name in report_stages)
+        # time the report has no finer stage for
+        stage_seconds['other'] += cohort_seconds['total'] - sum(
+            cohort_seconds.get(name, 0.0) for report_stages in REPORT_STAGES.values() for name in report_stages
+        )
+
+        counters['rows'] += report['counters'].get('rows_parsed', 0)
+        counters['features'] = max(counters['features'], report['counters'].get('features', 0))
+        counters['pairs'] += report['counters'].get('pairs_computed', 0)
+        counters['build_pair_records'] += report['counters'].get('pair_records_written', 0)
+
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(ICEES_KG_PATH / 'massage.py'), '--workers', str(massage_workers)],
+        cwd=repeat_path,
+        check=True,
+    )
+    stage_seconds['massage'] += time.perf_counter() - start
+    counters['release_edges'] = count_lines(repeat_path / 'releases' / release_version() / 'edges.jsonl')
+
+    return stage_seconds, counters
+
+
+def compare_results(baseline, results, tolerance, min_seconds):
+    """Print how each stage's time changed from a baseline run.
+
+    Returns the stages that got slower by more than tolerance (a fraction) and
+    more than min_seconds.
+    """
+    if baseline.get('config') != results['config']:
+        print('Warning: the baseline was run with a different config, times may not be comparable')
+    print(f"{'stage':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    regressions = []
+    for stage in STAGES + ['total']:
+        if stage not in baseline.get('stages', {}):
+            continue
+        before = baseline['stages'][stage]['seconds']
+        after = results['stages'][stage]['seconds']
+        change = (after - before) / before if before else 0.0
+        regressed = change > tolerance and after - before > min_seconds
+        if regressed:
+            regressions.append(stage)
+        print(f"{stage:<12} {before:>9.3f}s {after:>9.3f}s {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the stages of an ICEES KG build on synthetic cohorts.')
+    parser.add_argument('--rows', type=int, default=20000, help='Patients per cohort.')
+    parser.add_argument('--cohorts', type=int, default=2, help='Number of cohort years.')
+    parser.add_argument('--binary-features', type=int, default=20, help='Number of true/false features.')
+    parser.add_argument('--enum-features', type=int, default=5, help='Number of categorical features.')
+    parser.add_argument('--enum-levels', type=int, default=4, help='Levels of each categorical feature.')
+    parser.add_argument('--integer-features', type=int, default=2, help='Number of integer features.')
+    parser.add_argument('--integer-range', type=int, default=90, help='Values of each integer feature.')
+    parser.add_argument('--curies-per-feature', type=int, default=2, help='Name resolver limit of each feature.')
+    parser.add_argument('--missing-rate', type=float, default=0.1, help='Fraction of empty values.')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds the stub services wait before every response.')
+    parser.add_argument('--pair-workers', type=int, default=1, help='Processes computing pair stats.')
+    parser.add_argument('--massage-workers', type=int, default=1, help='Processes running massage.py.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every stage, the fastest is reported.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='Where to put the synthetic cohorts and outputs, a temporary folder by default.')
+    parser.add_argument('--output', default=None, help='Where to write the results JSON.')
+    parser.add_argument('--compare', default=None, help='Results JSON of a baseline run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown, as a fraction, that counts as a regression.')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='Slowdowns shorter than this are never regressions.')
+    args = parser.parse_args()
+
+    config_keys = [
+        'rows', 'cohorts', 'binary_features', 'enum_features', 'enum_levels', 'integer_features', 'integer_range',
+        'curies_per_feature', 'missing_rate', 'latency', 'pair_workers', 'massage_workers', 'seed',
+    ]
+    config = {key: getattr(args, key) for key in config_keys}
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        work_path = Path(work_dir)
+        data_csvs, features_yaml = generate_cohorts(
+            work_path,
+            rows=args.rows,
+            cohorts=args.cohorts,
+            binary_features=args.binary_features,
+            enum_features=args.enum_features,
+            enum_levels=args.enum_levels,
+            integer_features=args.integer_features,
+            integer_range=args.integer_range,
+            curies_per_feature=args.curies_per_feature,
+            missing_rate=args.missing_rate,
+            seed=args.seed,
+        )
+
+        port = get_free_port()
+        os.environ.update({
+            'NAME_RESOLVER': f'http://127.0.0.1:{port}/lookup',
+            'NODE_NORM': f'http://127.0.0.1:{port}/get_normalized_nodes',
+            'NODE_LOOKUP_CACHE_ONLY': 'false',
+            'COHORT_CACHE': '',
+        })
+        sys.path.insert(0, str(ICEES_KG_PATH))
+        stub_services = start_stub_services(port, args.latency)
+        runs = {stage: [] for stage in STAGES + ['total']}
+        cwd = os.getcwd()
+        try:
+            for k in range(args.repeat):
+                stage_seconds, counters = time_build(work_path / f'run_{k}', data_csvs, features_yaml, args.pair_workers, args.massage_workers)
+                for stage, seconds in stage_seconds.items():
+                    runs[stage].append(seconds)
+                runs['total'].append(sum(stage_seconds.values()))
+                print(f"Run {k + 1}/{args.repeat}: {runs['total'][-1]:.3f}s")
+        finally:
+            os.chdir(cwd)
+            stub_services.terminate()
+            stub_services.wait()
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git': get_git_info(),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'cpus': os.cpu_count(),
+        },
+        'config': config,
+        'counters': counters,
+        'stages': {stage: {'seconds': min(stage_runs), 'runs': stage_runs} for stage, stage_runs in runs.items()},
+    }
+
+    for stage, stage_results in results['stages'].items():
+        print(f"{stage:<12} {stage_results['seconds']:>9.3f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Wrote {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"Regressions in {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Local stand-ins for the name resolver and node norm services, with configurable latency.
+
+The name resolver at /lookup returns `limit` made up curies for any search term,
+and node norm at /get_normalized_nodes normalizes every curie to itself.
+Search terms in fail_terms get a 500 from the name resolver.
+"""
+import argparse
+from aiohttp import web
+import asyncio
+
+
+def get_app(latency=0.0, fail_terms=(), stats=None):
+    """Get the stub services app, which waits latency seconds before every response.
+
+    Request counts are kept in stats, if given, and served at /stats.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({'lookup_requests': 0, 'norm_requests': 0, 'norm_curies': 0, 'in_flight': 0, 'max_in_flight': 0})
+
+    async def lookup(request):
+        stats['lookup_requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            stats['in_flight'] -= 1
+        search_term = request.query['string']
+        if search_term in fail_terms:
+            raise web.HTTPInternalServerError()
+        limit = int(request.query.get('limit', 10))
+        return web.json_response([
+            {'curie': f'BENCH:{search_term}_{k}', 'label': f'{search_term} {k}'}
+            for k in range(limit)
+        ])
+
+    async def get_normalized_nodes(request):
+        stats['norm_requests'] += 1
+        await asyncio.sleep(latency)
+        curies = (await request.json())['curies']
+        stats['norm_curies'] += len(curies)
+        return web.json_response({
+            curie: {
+                'id': {'identifier': curie, 'label': curie.split(':', 1)[-1]},
+                'equivalent_identifiers': [{'identifier': curie}],
+                'type': ['biolink:PhenotypicFeature', 'biolink:NamedThing'],
+            }
+            for curie in curies
+        })
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post('/lookup', lookup)
+    app.router.add_post('/get_normalized_nodes', get_normalized_nodes)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve stand-ins for the name resolver and node norm.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every response.')
+    args = parser.parse_args()
+    web.run_app(get_app(args.latency), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Query feature pair stats of any cohort from its saved count tables.
+
+Run from this folder with `uvicorn api:app`.
+"""
+from collections import OrderedDict
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query
+import logging
+import math
+import numpy as np
+import os
+from pathlib import Path
+import threading
+from typing import List
+
+load_dotenv()
+
+from utils.contingency import get_level_offsets, get_pair_count_matrix, select_feature_counts
+from utils.count_tables import load_count_tables, load_count_tables_index
+from utils.get_features import get_feature_info_from_column_info
+from utils.manifest import get_pair_key
+from utils.pair_stats import compute_pair_stats
+
+LOGGER = logging.getLogger(__name__)
+
+# where main.py saves the count tables of each cohort
+count_tables_path = Path(os.getenv('COUNT_TABLES', f"{Path(__file__).parent.parent.resolve()}/build/count_tables"))
+# number of feature pair results kept in memory
+query_cache_size = int(os.getenv('QUERY_CACHE_SIZE', 100000))
+
+
+class LRUCache:
+    """A thread-safe cache that drops the least recently used entries past max_size."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get a cached value, None if it isn't cached."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        """Cache a value."""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+pair_cache = LRUCache(query_cache_size)
+# memory-mapped count tables by cohort, with the modification time they were loaded at
+open_count_tables = {}
+open_count_tables_lock = threading.Lock()
+
+app = FastAPI(
+    title='ICEES KG pair stats',
+    description='Feature pair statistics computed on request from the count tables of each cohort.',
+)
+
+
+def to_response(value):
+    """Convert numpy values, and nan or inf floats which JSON can't hold, for a response."""
+    if isinstance(value, dict):
+        return {key: to_response(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_response(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return to_response(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def get_count_tables(cohort):
+    """Get the memory-mapped count tables of a cohort, reloading them if they were rebuilt."""
+    cohort_path = count_tables_path / cohort
+    try:
+        mtime = (cohort_path / 'index.json').stat().st_mtime
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f'No count tables for cohort {cohort}')
+    with open_count_tables_lock:
+        if cohort not in open_count_tables or open_count_tables[cohort][0] != mtime:
+            tables = load_count_tables(cohort_path)
+            if tables is None:
+                raise HTTPException(status_code=404, detail=f'No count tables for cohort {cohort}')
+            open_count_tables[cohort] = (mtime, tables)
+        return open_count_tables[cohort][1]
+
+
+def get_position(tables, feature):
+    """Get a feature's position in the count tables."""
+    if feature not in tables['column_index']:
+        raise HTTPException(status_code=404, detail=f'Unknown feature {feature}')
+    return tables['column_index'][feature]['position']
+
+
+def get_pair_results(tables, pairs):
+    """Get the stats of feature pairs, given as (i, j) positions with i < j.
+
+    Only the count matrix blocks of the features involved are read, and pairs
+    that aren't cached are computed together.
+    """
+    pair_keys = [
+        get_pair_key(tables['csv_hash'], tables['column_hashes'][i_col], tables['column_hashes'][j_col])
+        for i_col, j_col in pairs
+    ]
+    results = [pair_cache.get(pair_key) for pair_key in pair_keys]
+    new_pairs = [pair for pair, result in zip(pairs, results) if result is None]
+    if new_pairs:
+        features = sorted({col for pair in new_pairs for col in pair})
+        pair_counts, invalid_present = select_feature_counts(tables['pair_counts'], tables['invalid_present'], tables['n_levels'], features)
+        pair_counts = pair_counts.astype(np.float64)
+        code_index = {col: k for k, col in enumerate(features)}
+        level_offsets = get_level_offsets([tables['n_levels'][col] for col in features])
+        column_infos = {col: tables['column_index'][tables['columns'][col]]['info'] for col in features}
+        # the count matrices only have the levels observed in the cohort
+        feature_infos = {col: get_feature_info_from_column_info(column_infos[col], tables['column_levels'][col]) for col in features}
+        new_stats = iter(compute_pair_stats(pair_counts, level_offsets, code_index, new_pairs, column_infos))
+        for k, ((i_col, j_col), pair_key) in enumerate(zip(pairs, pair_keys)):
+            if results[k] is not None:
+                continue
+            stats = next(new_stats)
+            result = {
+                'subject_feature': feature_infos[i_col],
+                'object_feature': feature_infos[j_col],
+                # the subject feature is on the cols, the object feature on the rows
+                'count_matrix': get_pair_count_matrix(pair_counts, level_offsets, code_index[i_col], code_index[j_col]),
+                'count_errors': bool(invalid_present[code_index[i_col], code_index[j_col]] or invalid_present[code_index[j_col], code_index[i_col]]),
+            }
+            if isinstance(stats, str):
+                result['error'] = stats
+            else:
+                result['predicate'], result['edge_stats'] = stats
+            results[k] = to_response(result)
+            pair_cache.set(pair_key, results[k])
+    return results
+
+
+def get_ordered_pair(i_col, j_col):
+    """Put a pair in the order its edges are built in."""
+    return (i_col, j_col) if i_col < j_col else (j_col, i_col)
+
+
+@app.get('/cohorts')
+def list_cohorts():
+    """List the cohorts that have count tables."""
+    return sorted(
+        path.name for path in count_tables_path.glob('*')
+        if path.is_dir() and load_count_tables_index(path) is not None
+    )
+
+
+@app.get('/cohorts/{cohort}/features')
+def list_features(cohort: str):
+    """List the features of a cohort."""
+    tables = get_count_tables(cohort)
+    return to_response([
+        {
+            'feature_name': column,
+            'n_levels': tables['column_index'][column]['n_levels'],
+            'n_values': tables['column_index'][column]['n_values'],
+            'feature_qualifiers': get_feature_info_from_column_info(tables['column_index'][column]['info'], levels)['feature_qualifiers'],
+        }
+        for column, levels in zip(tables['columns'], tables['column_levels'])
+    ])
+
+
+@app.get('/cohorts/{cohort}/pair')
+def get_pair(cohort: str, feature_a: str, feature_b: str):
+    """Get the stats of one feature pair."""
+    tables = get_count_tables(cohort)
+    i_col, j_col = get_position(tables, feature_a), get_position(tables, feature_b)
+    if i_col == j_col:
+        raise HTTPException(status_code=400, detail='A feature pair needs two different features')
+    return get_pair_results(tables, [get_ordered_pair(i_col, j_col)])[0]
+
+
+@app.get('/cohorts/{cohort}/features/{feature}/associations')
+def get_feature_associations(cohort: str, feature: str, with_features: List[str] = Query(None)):
+    """Get the stats of a feature paired with every other feature, or with_features."""
+    tables = get_count_tables(cohort)
+    i_col = get_position(tables, feature)
+    others = [get_position(tables, other) for other in with_features] if with_features else range(len(tables['columns']))
+    pairs = [get_ordered_pair(i_col, j_col) for j_col in others if j_col != i_col]
+    return get_pair_results(tables, pairs)
+
+
+@app.get('/cohorts/{cohort}/associations')
+def get_associations(cohort: str, features: List[str] = Query(...)):
+    """Get the stats of every pair in a subset of features."""
+    tables = get_count_tables(cohort)
+    cols = sorted({get_position(tables, feature) for feature in features})
+    pairs = [(i_col, j_col) for i_col in cols for j_col in cols if j_col > i_col]
+    return get_pair_results(tables, pairs)
+
+
+@app.get('/cache')
+def get_cache_info():
+    """Get the pair cache size and hit counts."""
+    return {
+        'size': len(pair_cache.entries),
+        'max_size': pair_cache.max_size,
+        'hits': pair_cache.hits,
+        'misses': pair_cache.misses,
+    }
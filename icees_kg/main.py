@@ -1,4 +1,7 @@
+import argparse
 import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
@@ -11,321 +14,729 @@ import yaml
 
 load_dotenv()
 
-from Common.kgxmodel import kgxnode, kgxedge
+from Common.kgxmodel import kgxnode
 from Common.kgx_file_writer import KGXFileWriter
-from Common.kgx_file_normalizer import remove_unconnected_nodes
 
-from utils.node_lookup import node_lookup
-from utils.get_features import get_feature_info_from_column_info, get_edge_stats
-
-now = datetime.now()
-now_string = now.strftime('%Y_%m_%d_%H_%M_%S')
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s: %(levelname)s/%(name)s]: %(message)s",
-    handlers=[
-        logging.FileHandler(f"{Path(__file__).parent.parent.resolve()}/logs/icees_kg_{now_string}.log"),
-        logging.StreamHandler(sys.stdout),
-    ]
+from utils.node_lookup import resolve_features, get_column_nodes, lookup_counters
+from utils.node_registry import NodeRegistry
+from utils.get_features import get_feature_info_from_column_info
+from utils.contingency import get_all_pair_counts, get_level_codes, get_level_offsets, get_observed_levels, reindex_pair_counts, select_feature_counts, get_pair_count_matrix, get_batched_cmh, drop_empty_margins
+from utils.encoding import get_data_column_info, encode_rows, get_code_dtype, MISSING_CODE
+from utils.cohort_cache import (
+    get_file_hash,
+    get_column_info_hash,
+    get_cohort_cache_key,
+    load_encoded_cohort,
+    EncodedCohortWriter,
 )
-LOGGER = logging.getLogger(__name__)
-
-data_path = os.getenv('DATA_PATH', None)
-assert data_path is not None, 'An environment variable called DATA_PATH is required.'
-data_csvs = Path(data_path).glob('*.csv')
-
-features_yml = os.getenv('FEATURES_YAML', None)
-assert features_yml is not None, 'An environment variable called FEATURES_YAML is required.'
-
-dataset_name = os.getenv('DATASET_NAME', None)
-assert dataset_name is not None, 'An environment variable called DATASET_NAME is required.'
+from utils.manifest import get_pair_key, load_manifest, save_manifest
+from utils.pair_stats import compute_all_pair_stats
+from utils.edge_filter import filter_pair_stats, P_VALUE_CORRECTIONS
+from utils.count_tables import save_count_tables, load_count_tables_index, load_count_tables, get_aligned_count_tables
+from utils.json_codec import dumps
+from utils.pair_records import get_pairs_path, get_curies_path, get_pair_record, save_feature_curies
+from utils.compression import COMPRESSIONS, CompressedWriter, compress_file, get_compressed_path, remove_other_compressions
+from utils.instrumentation import RunReport, RateLimitedProgress, profiled, save_run_report
 
-# create output folder
-if not os.path.exists('../build'):
-    os.makedirs('../build')
-LOGGER.info(f'Running precompute for dataset: {dataset_name}')
-LOGGER.info('Loading data files...')
-
-with open(features_yml, 'r') as f:
-    full_features = yaml.safe_load(f)
-    features = full_features['patient']
-
-for data_csv in tqdm(data_csvs):
-    data = []
-    # get database identifier, i.e. asthma_cohort_2010
-    data_id = data_csv.stem
-    year = data_id.split('_')[4]
-    icees_cohort_identifier = f'{data_id}|{dataset_name}|{year}|{now_string}'
+LOGGER = logging.getLogger(__name__)
 
-    with open(data_csv, 'r') as f:
-        c_data = [row for row in csv.DictReader(f)]
-        data.extend(c_data)
-
-    LOGGER.info('Making data columns...')
-    data_columns = list(data[0].keys())
-    data_column_info = dict()
-    for feature, feature_info in features.items():
-
-        # Figure out if this feature is in the data_columns
-        try:
-            feature_column_index = data_columns.index(feature)
-        except ValueError:
-            # This yaml feature is not found in the data csv
-            continue
-
-        if 'name_lookup' not in feature_info:
-            # we need a search term in order to include in kg
-            continue
-
-        # Double check that the features match
-        column = data_columns[feature_column_index]
-        if not column == feature:
-            raise Exception('How did we get here?')
-
-        # Set the current column information
-        if feature_info.get('enum', None):
-            # make sure enums are the same order every time
-            try:
-                feature_info["enum"].sort(key=lambda x: (isinstance(x, str), x))
-            except Exception:
-                print(feature_info)
-                raise KeyError()
-            column_info = {
-                'name': column,
-                'enum': feature_info['enum'],
-                'range': len(feature_info['enum']),
-                'min': 0,
-                'max': len(feature_info['enum']) - 1,
-                'is_integer': False,
-                'categories': feature_info.get('categories', []),
-                'name_lookup': feature_info.get('name_lookup', []),
-            }
-        else:
-            # No enum, probably an integer and may have min and max
-            if feature_info.get('type', None) == 'integer':
-                if feature_info.get('minimum', None) and feature_info.get('maximum', None):
-                    column_info = {
-                        'name': column,
-                        'enum': [],
-                        'range': feature_info['maximum'] - feature_info['minimum'] + 1,
-                        'min': feature_info['minimum'],
-                        'max': feature_info['maximum'],
-                        'is_integer': True,
-                        'categories': feature_info.get('categories', []),
-                        'name_lookup': feature_info.get('name_lookup', []),
-                    }
-                else:
-                    continue
+# number of patient rows one-hot encoded at a time when counting feature pairs
+contingency_block_size = int(os.getenv('CONTINGENCY_BLOCK_SIZE', 50000))
+# number of csv rows read and encoded at a time
+csv_chunk_size = int(os.getenv('CSV_CHUNK_SIZE', 200000))
+# where encoded cohorts are cached, empty to always parse the csvs
+cohort_cache_path = os.getenv('COHORT_CACHE', f"{Path(__file__).parent.parent.resolve()}/cache/cohorts")
+# number of feature pairs computed between manifest checkpoints
+pair_checkpoint_size = int(os.getenv('PAIR_CHECKPOINT_SIZE', 5000))
+# multiple-testing correction of the chi squared p-values across a cohort's pairs: none, bonferroni or bh
+edge_p_value_correction = os.getenv('EDGE_P_VALUE_CORRECTION', 'none').lower()
+# edges are only kept for pairs that meet these thresholds
+edge_max_p_value = float(os.getenv('EDGE_MAX_P_VALUE', 1))
+edge_min_sample_size = float(os.getenv('EDGE_MIN_SAMPLE_SIZE', 0))
+edge_min_cramers_v = float(os.getenv('EDGE_MIN_CRAMERS_V', 0))
+edge_min_abs_log_odds_ratio = float(os.getenv('EDGE_MIN_ABS_LOG_ODDS_RATIO', 0))
+# seconds between progress logs while writing a cohort's pair records
+progress_log_interval = float(os.getenv('PROGRESS_LOG_INTERVAL', 30))
+# compression of the nodes and pair records files: none, gzip or zstd
+build_compression = os.getenv('BUILD_COMPRESSION', 'none').lower()
+# compression level, 0 for the default of the compression
+build_compression_level = int(os.getenv('BUILD_COMPRESSION_LEVEL', 0))
+# threads compressing each zstd file, 0 to compress on the writing thread
+build_compression_threads = int(os.getenv('BUILD_COMPRESSION_THREADS', 0))
+
+
+def setup_logging(log_name):
+    """Log to stdout and to a file in the logs folder."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s: %(levelname)s/%(name)s]: %(message)s",
+        handlers=[
+            logging.FileHandler(f"{Path(__file__).parent.parent.resolve()}/logs/{log_name}.log"),
+            logging.StreamHandler(sys.stdout),
+        ],
+        force=True,
+    )
+
+
+def init_worker(now_string):
+    """Give each worker process its own log file."""
+    setup_logging(f'icees_kg_{now_string}_worker_{os.getpid()}')
+
+
+def iter_csv_chunks(reader, data_columns, data_column_info, report):
+    """Read and encode csv rows a chunk at a time."""
+    while True:
+        with report.stage('read_csv'):
+            data = list(itertools.islice(reader, csv_chunk_size))
+        if not data:
+            return
+        with report.stage('encode_rows'):
+            encoded_chunk = encode_rows(data, data_columns, data_column_info)
+        yield encoded_chunk
+
+
+def iter_cached_chunks(codes, unknown_values):
+    """Get a cached encoded cohort a chunk at a time."""
+    for start in range(0, len(codes), csv_chunk_size):
+        yield np.asarray(codes[start:start + csv_chunk_size]), unknown_values if start == 0 else {}
+
+
+def count_cohort(chunks, column_levels, report):
+    """Accumulate the feature pair counts of encoded chunks.
+
+    The counts only have a level for the codes in column_levels and the codes that
+    occur in the chunks, so they're sized by the observed values of wide integer
+    features rather than their declared range. Returns them with the levels they cover.
+    """
+    total_levels = sum(len(levels) for levels in column_levels)
+    pair_counts = np.zeros((total_levels, total_levels))
+    invalid_present = np.zeros((len(column_levels), len(column_levels)))
+    n_values = np.zeros(len(column_levels))
+    unknown_values = {}
+    n_rows = 0
+    for codes, chunk_unknown_values in chunks:
+        with report.stage('count_chunks'):
+            n_rows += len(codes)
+            n_values += np.sum(codes != MISSING_CODE, axis=0)
+            for column, values in chunk_unknown_values.items():
+                column_unknown_values = unknown_values.setdefault(column, {})
+                for value, count in values.items():
+                    column_unknown_values[value] = column_unknown_values.get(value, 0) + count
+            observed_levels = get_observed_levels(codes, column_levels)
+            if pair_counts.shape[0] != sum(len(levels) for levels in observed_levels):
+                pair_counts = reindex_pair_counts(pair_counts, column_levels, observed_levels)
+            column_levels = observed_levels
+            chunk_counts, chunk_invalid_present = get_all_pair_counts(
+                get_level_codes(codes, column_levels),
+                [len(levels) for levels in column_levels],
+                block_size=contingency_block_size,
+            )
+            pair_counts += chunk_counts
+            invalid_present += chunk_invalid_present
+    return pair_counts, column_levels, invalid_present, n_values, unknown_values, n_rows
+
+
+def get_cohort_counts(data_csv, csv_hash, data_columns, data_column_info, report):
+    """Get the feature pair counts of a cohort csv, from the encoded cohort cache if it's there.
+
+    Returns the counts with the levels of each column they cover.
+    """
+    with report.stage('count_pairs'):
+        n_levels = [column_info['range'] for column_info in data_column_info.values()]
+        # every enum value gets a level, integer features only get the values that occur
+        column_levels = [np.arange(0 if column_info['is_integer'] else column_info['range']) for column_info in data_column_info.values()]
+        # Counts are additive, so the cohort is encoded and counted a chunk at a time
+        LOGGER.info('Counting feature pairs...')
+        with open(data_csv, 'r') as f:
+            reader = csv.reader(f)
+            # skip the header
+            next(reader, None)
+            cached_cohort = None
+            if cohort_cache_path:
+                cache_key = get_cohort_cache_key(csv_hash, data_columns, data_column_info)
+                cached_cohort = load_encoded_cohort(cohort_cache_path, cache_key)
+            if cached_cohort is not None:
+                LOGGER.info('Using cached encoded cohort')
+                cached_codes, cache_meta = cached_cohort
+                cohort_counts = count_cohort(iter_cached_chunks(cached_codes, cache_meta['unknown_values']), column_levels, report)
+            elif cohort_cache_path:
+                with EncodedCohortWriter(cohort_cache_path, cache_key, list(data_column_info), get_code_dtype(n_levels)) as cache_writer:
+                    cohort_counts = count_cohort(cache_writer.write_chunks(iter_csv_chunks(reader, data_columns, data_column_info, report)), column_levels, report)
             else:
-                continue
-
-        data_column_info[column] = column_info
+                cohort_counts = count_cohort(iter_csv_chunks(reader, data_columns, data_column_info, report), column_levels, report)
+        pair_counts, column_levels, invalid_present, n_values, unknown_values, n_rows = cohort_counts
+        LOGGER.info(f'Read {n_rows} rows')
+        report.count('rows_from_cache' if cached_cohort is not None else 'rows_parsed', n_rows)
+        return pair_counts, column_levels, invalid_present, n_values, unknown_values
 
-    data_np = np.full((len(data), len(data_column_info.keys())), np.nan)
-    for i_col, (column, column_info) in enumerate(data_column_info.items()):
-        data_col_np = data_np[:, i_col]
-        if column_info['is_integer']:
-            for i_row, d in enumerate(data):
-                if d.get(column, None):
-                    if d[column] == 'Missing':
-                        continue
-                    data_col_np[i_row] = d[column]
-                # else leave nan
-        else:  # enum
-            # all enums seem to be ints or strings
-            enum_valid = [e for e in column_info["enum"] if not isinstance(e,str)]
-            enum_equal_map = {v: i for i, v in enumerate(column_info["enum"]) if not (isinstance(v,str) and ('>' in v or '<' in v))}
-            enum_gt = None
-            enum_lt = None
-            for i, e in enumerate(column_info["enum"]):
-                if isinstance(e, str):
-                    if '>' in e and enum_gt is None:
-                        enum_gt = {
-                            "label": e,
-                            "gt": float(e.replace('>','')),
-                            "val": i,
-                        }
-                    elif '<' in e and enum_lt is None:
-                        enum_lt = {
-                            "label": e,
-                            "lt": float(e.replace('<','')),
-                            "val": i,
-                        }
-            for i_row, d in enumerate(data):
-                if d.get(column, None):
-                    try:
-                        tmp = int(float(d[column]))
-                        if tmp == float(d[column]):
-                            d[column] = tmp
-                    except:
-                        # conversion didn't work
-                        pass
-                    try:
-                        if str(d[column]) in enum_equal_map:
-                            data_col_np[i_row] = enum_equal_map[str(d[column])]
-                        elif enum_gt and d[column] > enum_gt['gt']:
-                            data_col_np[i_row] = enum_gt['val']
-                        elif enum_lt and d[column] < enum_lt['lt']:
-                            data_col_np[i_row] = enum_lt['val']
-                        else:
-                            LOGGER.warning(f"Warning: {column} has a value not in the enums: {d[column]}")
-                            data_col_np[i_row] = np.nan
-                    except Exception as e:
-                        print(d, column)
-                        print(enum_equal_map)
-                        print(d[column])
-                        print(e)
-                        exit()
-                # else leave nan
 
-        # The above does this in place
-        # data_np[:,i_col] = data_col_np
+def get_feature_pairs(columns, n_values, resolved_nodes):
+    """Get the columns that can have edges and the pairs of them to compute stats for.
 
+    Returns the useful columns, the position of each in the count matrices, the
+    nodes of each column with nodes and the pairs.
+    """
     LOGGER.info('Getting useful features...')
     # Some features are all empty? So let's not worry about them
-    is_useful_feature = np.sum(np.isfinite(data_np), axis=0) > 0
-    useful_features = [k for i, k in enumerate(data_column_info.keys()) if is_useful_feature[i]]
+    is_useful_feature = n_values > 0
+    useful_features = [column for i_col, (column, _) in enumerate(columns) if is_useful_feature[i_col]]
     LOGGER.info(f'There are {len(useful_features)} useful features')
 
-    node_list = []
-    edge_list = []
-    node_dict = {}
-
-    LOGGER.info('Creating nodes and edges...')
-    columns = data_column_info.items()
-    for i_col, (i_column, i_column_info) in enumerate(tqdm(columns)):
-        # Don't worry about the features that are always empty
-        if not (i_column in useful_features):
-            continue
-
-        # resolve and normalize any search terms
-        if not ('name_lookup' in i_column_info):
-            continue
-
-        i_normalized_nodes = {}
-        for node_search in i_column_info['name_lookup']:
-            i_normalized_nodes.update(node_lookup(node_search['search_term'], node_search['limit']))
-
-        if not i_normalized_nodes:
-            # normalized_nodes could be empty dict
-            continue
-
-        for curie, node in i_normalized_nodes.items():
-            if "categories" in node and "categories" in i_column_info:
-                # add hard coded categories from features yaml file
-                node["categories"].extend(i_column_info["categories"])
-                node["categories"] = list(set(node["categories"]))
-            node_dict[curie] = node
-
-        feature_description_1 = get_feature_info_from_column_info(i_column_info)
-        x1 = data_np[:, i_col]
-        if i_column_info['is_integer']:
-            u_x1 = [ind + j_column_info['min'] for ind in range(i_column_info['range'])]
-        else:  # enum
-            u_x1 = list(range(len(i_column_info['enum'])))
-
-        for j_col, (j_column, j_column_info) in enumerate(columns):
-            if j_col <= i_col:
-                # Do upper triangle only
-                continue
-
-            # Don't worry about the features that are always empty
-            if not (j_column in useful_features):
+    useful_cols = [i_col for i_col, (column, _) in enumerate(columns) if column in useful_features]
+    # position of each useful column in the count matrices
+    code_index = {i_col: k for k, i_col in enumerate(useful_cols)}
+
+    column_nodes = {
+        i_col: get_column_nodes(column_info, resolved_nodes)
+        for i_col, (_, column_info) in enumerate(columns)
+        if i_col in code_index and 'name_lookup' in column_info
+    }
+
+    # upper triangle only, and only columns that have nodes
+    pairs = [
+        (i_col, j_col)
+        for i_col in useful_cols
+        for j_col in useful_cols
+        if j_col > i_col and column_nodes.get(i_col) and column_nodes.get(j_col)
+    ]
+    return useful_cols, code_index, column_nodes, pairs
+
+
+def filter_pairs(pairs, pair_manifests, column_nodes, report=None):
+    """Get the pairs that pass the edge filter and their adjusted p-values."""
+    stats_pairs = [pair for pair in pairs if not isinstance(pair_manifests[pair]['stats'], str)]
+    adjusted_p_values = {}
+    kept_pairs = set(stats_pairs)
+    if edge_p_value_correction != 'none' or edge_max_p_value < 1 or edge_min_sample_size > 0 or edge_min_cramers_v > 0 or edge_min_abs_log_odds_ratio > 0:
+        LOGGER.info('Filtering feature pairs...')
+        pair_adjusted_p_values, keep = filter_pair_stats(
+            [pair_manifests[pair]['stats'][1] for pair in stats_pairs],
+            # the chi squared test only covers observed levels
+            [pair_manifests[pair]['observed_shape'] for pair in stats_pairs],
+            correction=edge_p_value_correction,
+            max_p_value=edge_max_p_value,
+            min_sample_size=edge_min_sample_size,
+            min_cramers_v=edge_min_cramers_v,
+            min_abs_log_odds_ratio=edge_min_abs_log_odds_ratio,
+        )
+        if edge_p_value_correction != 'none':
+            adjusted_p_values = dict(zip(stats_pairs, pair_adjusted_p_values))
+        kept_pairs = {pair for pair, kept in zip(stats_pairs, keep) if kept}
+        n_pair_edges = {(i_col, j_col): len(column_nodes[i_col]) * len(column_nodes[j_col]) for i_col, j_col in stats_pairs}
+        n_pruned_pairs = len(stats_pairs) - len(kept_pairs)
+        n_pruned_edges = sum(n_edges for pair, n_edges in n_pair_edges.items() if pair not in kept_pairs)
+        LOGGER.info(
+            f'Pruned {n_pruned_pairs} of {len(stats_pairs)} feature pairs '
+            f'and {n_pruned_edges} of {sum(n_pair_edges.values())} edges'
+        )
+        if report is not None:
+            report.count('pairs_pruned', n_pruned_pairs)
+            report.count('edges_pruned', n_pruned_edges)
+    return kept_pairs, adjusted_p_values
+
+
+def write_build_files(data_id, icees_cohort_identifier, columns, column_nodes, pair_manifests, kept_pairs, adjusted_p_values, progress=True, report=None, build_dir='../build'):
+    """Write the nodes, pair records and feature curies files of a cohort's feature pairs to build_dir.
+
+    Every pair record stands for an edge between each curie of its subject feature
+    and each curie of its object feature. massage.py expands them into edges.
+    """
+    # only the nodes of features in at least one pair record are written
+    node_registry = NodeRegistry()
+    for col, (_, column_info) in enumerate(columns):
+        if column_nodes.get(col):
+            node_registry.add_feature_nodes(column_nodes[col], column_info.get('categories'))
+    n_pairs = 0
+    n_edges = 0
+    pair_progress = RateLimitedProgress(LOGGER, f'Wrote records of {data_id} pairs', len(pair_manifests), interval=progress_log_interval)
+
+    # Pair records are written pair by pair, nodes and feature curies once every pair is done.
+    # They are moved into place once the cohort is complete.
+    nodes_uncompressed_path = f'{build_dir}/{data_id}_nodes.jsonl'
+    nodes_output_file_path = get_compressed_path(nodes_uncompressed_path, build_compression)
+    pairs_output_file_path = get_compressed_path(get_pairs_path(data_id, build_dir), build_compression)
+    curies_output_file_path = get_curies_path(pairs_output_file_path)
+    # ORION's writer can only write uncompressed nodes, so they're compressed after
+    kgx_nodes_tmp_file_path = f'{nodes_uncompressed_path}.kgx.tmp'
+    nodes_tmp_file_path = f'{nodes_output_file_path}.tmp'
+    pairs_tmp_file_path = f'{pairs_output_file_path}.tmp'
+
+    with KGXFileWriter(nodes_output_file_path=kgx_nodes_tmp_file_path) as file_writer, CompressedWriter(pairs_tmp_file_path, build_compression, build_compression_level, build_compression_threads) as pairs_file:
+        LOGGER.info('Creating nodes and pair records...')
+        for i_col, (i_column, i_column_info) in enumerate(tqdm(columns, disable=not progress)):
+            # Only features that aren't always empty and have search terms have nodes
+            i_normalized_nodes = column_nodes.get(i_col)
+
+            if not i_normalized_nodes:
+                # normalized_nodes could be empty dict
                 continue
 
-            # name resolve any search terms
-            if not ('name_lookup' in j_column_info):
-                continue
+            feature_description_1 = get_feature_info_from_column_info(i_column_info)
 
-            j_normalized_nodes = {}
-            for node_search in j_column_info['name_lookup']:
-                normalized_node = node_lookup(node_search['search_term'], node_search['limit'])
-                j_normalized_nodes.update(normalized_node)
+            for j_col, (j_column, j_column_info) in enumerate(columns):
+                if j_col <= i_col:
+                    # Do upper triangle only
+                    continue
 
-            if not j_normalized_nodes:
-                # normalized_nodes could be empty dict
-                continue
+                # Only features that aren't always empty and have search terms have nodes
+                j_normalized_nodes = column_nodes.get(j_col)
 
-            for curie, node in j_normalized_nodes.items():
-                if "categories" in node and "categories" in j_column_info:
-                    # add hard coded categories from features yaml file
-                    node["categories"].extend(j_column_info["categories"])
-                    node["categories"] = list(set(node["categories"]))
-                node_dict[curie] = node
-
-            feature_description_2 = get_feature_info_from_column_info(j_column_info)
-            x2 = data_np[:, j_col]
-            if j_column_info['is_integer']:
-                u_x2 = [ind + j_column_info['min'] for ind in range(j_column_info['range'])]
-            else:  # enum
-                u_x2 = list(range(len(j_column_info['enum'])))
-
-            LOGGER.info(f"{feature_description_1['feature_name']} -> {feature_description_2['feature_name']}")
-            # Calculate stats for i_col and j_col
-            # x1 is the column_sum
-            # x2 is the row_sum
-            try:
-                predicate, edge_stats = get_edge_stats(x1, x2, u_x1, u_x2, i_column, j_column, i_column_info, j_column_info)
-            except Exception as e:
-                LOGGER.error(f"Error making edge stats: {e}")
-                continue
-
-            # if edge_stats["chi_squared_p"] > 0.5:
-            #     # discard any edges that aren't significant
-            #     continue
-
-            # Package edge properties
-            edge_props = {
-                'biolink:has_supporting_study_result': 'https://github.com/NCATSTranslator/Translator-All/wiki/ICEES',
-                'terms_and_conditions_of_use': 'https://github.com/NCATSTranslator/Translator-All/wiki/Exposures-Provider-ICEES-and-ICEES-KG-Terms-and-Conditions-of-Use',
-                'icees_cohort_identifier': icees_cohort_identifier,
-                'subject_feature_name': feature_description_1['feature_name'],
-                'object_feature_name': feature_description_2['feature_name'],
-            }
-            edge_props.update(edge_stats)
-
-            for i_id in i_normalized_nodes.keys():
-                for j_id in j_normalized_nodes.keys():
-
-                    new_edge = kgxedge(
-                        subject_id=i_id,
-                        object_id=j_id,
-                        predicate=predicate,
-                        primary_knowledge_source="infores:icees-kg",
-                        edgeprops=edge_props,
-                    )
-                    edge_list.append(new_edge)
-
-    LOGGER.info('Writing files...')
-
-    for node, node_vals in node_dict.items():
-        node_list.append(kgxnode(
-            node,
-            name=node_vals.get('name', ''),
-            categories=node_vals.get('categories', []),
-            nodeprops={
-                'equivalent_identifiers': node_vals.get('equivalent_identifiers', []),
-                # TODO: include information content if it exists
-            },
-        ))
+                if not j_normalized_nodes:
+                    # normalized_nodes could be empty dict
+                    continue
 
-    # Write json output output
-    nodes_output_file_path = f'../build/{data_id}_nodes.jsonl'
-    edges_output_file_path = f'../build/{data_id}_edges.jsonl'
+                feature_description_2 = get_feature_info_from_column_info(j_column_info)
+
+                pair_progress.update()
+                # Calculate stats for i_col and j_col
+                # x1 (i) is on the cols of the count matrix
+                # x2 (j) is on the rows of the count matrix
+                pair_manifest = pair_manifests[(i_col, j_col)]
+                if pair_manifest['count_errors']:
+                    LOGGER.warning(f"Computed count matrix with errors for {i_column} and {j_column}")
+                if isinstance(pair_manifest['stats'], str):
+                    LOGGER.error(f"Error making edge stats: {pair_manifest['stats']}")
+                    continue
+                if (i_col, j_col) not in kept_pairs:
+                    # discard any edges that don't pass the filter
+                    continue
+                predicate, edge_stats = pair_manifest['stats']
+
+                # Package edge properties
+                edge_props = {
+                    'biolink:has_supporting_study_result': 'https://github.com/NCATSTranslator/Translator-All/wiki/ICEES',
+                    'terms_and_conditions_of_use': 'https://github.com/NCATSTranslator/Translator-All/wiki/Exposures-Provider-ICEES-and-ICEES-KG-Terms-and-Conditions-of-Use',
+                    'icees_cohort_identifier': icees_cohort_identifier,
+                    'subject_feature_name': feature_description_1['feature_name'],
+                    'object_feature_name': feature_description_2['feature_name'],
+                }
+                edge_props.update(edge_stats)
+                if (i_col, j_col) in adjusted_p_values:
+                    edge_props['chi_squared_p_adjusted'] = adjusted_p_values[(i_col, j_col)]
+
+                pairs_file.write(f'{dumps(get_pair_record(i_column, j_column, predicate, edge_props))}\n'.encode())
+                node_registry.connect(i_normalized_nodes)
+                node_registry.connect(j_normalized_nodes)
+                n_pairs += 1
+                n_edges += len(i_normalized_nodes) * len(j_normalized_nodes)
+
+        pair_progress.close()
+        LOGGER.info('Writing nodes...')
+        for node, node_vals, categories in node_registry.iter_connected_nodes():
+            file_writer.write_kgx_node(kgxnode(
+                node,
+                name=node_vals.get('name', ''),
+                categories=categories,
+                nodeprops={
+                    'equivalent_identifiers': node_vals.get('equivalent_identifiers', []),
+                    # TODO: include information content if it exists
+                },
+            ))
+
+    nodes_file_info = compress_file(kgx_nodes_tmp_file_path, nodes_tmp_file_path, build_compression, build_compression_level, build_compression_threads)
+    os.remove(kgx_nodes_tmp_file_path)
+    save_feature_curies(curies_output_file_path, {
+        column: list(column_nodes[col])
+        for col, (column, _) in enumerate(columns)
+        if column_nodes.get(col)
+    })
+    os.replace(pairs_tmp_file_path, pairs_output_file_path)
+    os.replace(nodes_tmp_file_path, nodes_output_file_path)
+    remove_other_compressions(get_pairs_path(data_id, build_dir), build_compression)
+    remove_other_compressions(nodes_uncompressed_path, build_compression)
+    save_manifest(f'{build_dir}/{data_id}_files.json', {
+        os.path.basename(pairs_output_file_path): pairs_file.get_file_info(),
+        os.path.basename(nodes_output_file_path): nodes_file_info,
+    })
+
+    if report is not None:
+        report.count('pair_records_written', n_pairs)
+        report.count('edges_written', n_edges)
+        report.count('nodes_written', len(node_registry.connected))
+
+
+def process_cohort(data_csv, features, resolved_nodes, dataset_name, now_string, progress=True, pair_workers=1, clean=False, profile_dir=None, csv_hash=None):
+    """Compute the build files for one cohort csv.
+
+    Returns the cohort's id and the report of its stages and counters.
+    """
+    report = RunReport()
+    with report.stage('total'), profiled(profile_dir and f'{profile_dir}/{data_csv.stem}.prof'):
+        data_id = build_cohort(data_csv, features, resolved_nodes, dataset_name, now_string, report, progress=progress, pair_workers=pair_workers, clean=clean, csv_hash=csv_hash)
+    return data_id, report.to_dict()
+
+
+def build_cohort(data_csv, features, resolved_nodes, dataset_name, now_string, report, progress=True, pair_workers=1, clean=False, csv_hash=None):
+    """Compute the build files for one cohort csv, recording its stages in report.
+
+    csv_hash is computed if it isn't given.
+    """
+    # get database identifier, i.e. asthma_cohort_2010
+    data_id = data_csv.stem
+    year = data_id.split('_')[4]
+    icees_cohort_identifier = f'{data_id}|{dataset_name}|{year}|{now_string}'
 
-    with KGXFileWriter(nodes_output_file_path, edges_output_file_path) as file_writer:
+    if csv_hash is None:
+        with report.stage('hash_csv'):
+            csv_hash = get_file_hash(data_csv)
+    manifest_path = f'../build/{data_id}_manifest.json'
+    manifest = {} if clean else load_manifest(manifest_path)
 
-        # for each edge captured
-        for edge in edge_list:
-            # write out the edge data
-            file_writer.write_kgx_edge(edge)
+    with open(data_csv, 'r') as f:
+        LOGGER.info('Making data columns...')
+        data_columns = next(csv.reader(f), [])
+    data_column_info = get_data_column_info(data_columns, features)
+    columns = list(data_column_info.items())
+    report.count('features', len(columns))
+    column_hashes = [get_column_info_hash(column_info) for _, column_info in columns]
+
+    # columns that are unchanged since the last build of this csv
+    known_columns = {}
+    if manifest.get('csv_hash') == csv_hash:
+        known_columns = {
+            column: manifest['columns'][column]
+            for (column, _), column_hash in zip(columns, column_hashes)
+            if manifest['columns'].get(column, {}).get('hash') == column_hash
+        }
+
+    pair_counts = None
+    if len(known_columns) == len(columns):
+        LOGGER.info('Reusing feature value counts from the manifest')
+        n_values = np.array([known_columns[column]['n_values'] for column, _ in columns])
+        unknown_values = {column: known_columns[column]['unknown_values'] for column, _ in columns if known_columns[column]['unknown_values']}
+    else:
+        pair_counts, column_levels, invalid_present, n_values, unknown_values = get_cohort_counts(data_csv, csv_hash, data_columns, data_column_info, report)
+
+    # The count tables are saved so cohorts can be pooled without reading their rows again
+    count_tables_path = f'../build/count_tables/{data_id}'
+    count_tables_index = load_count_tables_index(count_tables_path)
+    if clean or not count_tables_index or count_tables_index['csv_hash'] != csv_hash or count_tables_index['column_hashes'] != column_hashes:
+        if pair_counts is None:
+            pair_counts, column_levels, invalid_present, _, _ = get_cohort_counts(data_csv, csv_hash, data_columns, data_column_info, report)
+        LOGGER.info('Saving count tables...')
+        with report.stage('save_count_tables'):
+            save_count_tables(
+                count_tables_path,
+                csv_hash,
+                [column for column, _ in columns],
+                column_hashes,
+                [column_info for _, column_info in columns],
+                column_levels,
+                n_values,
+                pair_counts,
+                invalid_present,
+            )
+
+    for column, values in unknown_values.items():
+        examples = ', '.join(sorted(values, key=values.get, reverse=True)[:5])
+        LOGGER.warning(f"Warning: {column} has {sum(values.values())} unexpected values, e.g. {examples}")
+        report.count('out_of_enum_values', sum(values.values()))
+
+    useful_cols, code_index, column_nodes, pairs = get_feature_pairs(columns, n_values, resolved_nodes)
+    pair_keys = {(i_col, j_col): get_pair_key(csv_hash, column_hashes[i_col], column_hashes[j_col]) for i_col, j_col in pairs}
+    # pairs whose inputs are unchanged keep their stats from the last build
+    pair_manifests = {pair: manifest['pairs'][pair_keys[pair]] for pair in pairs if pair_keys[pair] in manifest.get('pairs', {})}
+    new_pairs = [pair for pair in pairs if pair not in pair_manifests]
+
+    def get_cohort_manifest():
+        return {
+            'csv_hash': csv_hash,
+            'columns': {
+                column: {
+                    'hash': column_hash,
+                    'n_values': n_values[i_col],
+                    'unknown_values': unknown_values.get(column, {}),
+                }
+                for i_col, ((column, _), column_hash) in enumerate(zip(columns, column_hashes))
+            },
+            'pairs': {pair_keys[pair]: pair_manifests[pair] for pair in pairs if pair in pair_manifests},
+        }
+
+    LOGGER.info(f'Computing feature pair stats for {len(new_pairs)} of {len(pairs)} pairs...')
+    report.count('pairs_computed', len(new_pairs))
+    report.count('pairs_reused', len(pairs) - len(new_pairs))
+    if new_pairs:
+        if pair_counts is None:
+            pair_counts, column_levels, invalid_present, _, _ = get_cohort_counts(data_csv, csv_hash, data_columns, data_column_info, report)
+        n_levels = [len(levels) for levels in column_levels]
+        pair_counts, invalid_present = select_feature_counts(pair_counts, invalid_present, n_levels, useful_cols)
+        level_offsets = get_level_offsets([n_levels[i_col] for i_col in useful_cols])
+        # The manifest is saved after every checkpoint shard so an interrupted run can pick up from there
+        for start in range(0, len(new_pairs), pair_checkpoint_size):
+            checkpoint_pairs = new_pairs[start:start + pair_checkpoint_size]
+            with report.stage('pair_stats'):
+                checkpoint_pair_stats = compute_all_pair_stats(
+                    pair_counts,
+                    level_offsets,
+                    code_index,
+                    checkpoint_pairs,
+                    [column_info for _, column_info in columns],
+                    workers=pair_workers,
+                )
+            for (i_col, j_col), stats in zip(checkpoint_pairs, checkpoint_pair_stats):
+                pair_manifests[(i_col, j_col)] = {
+                    'count_errors': bool(invalid_present[code_index[i_col], code_index[j_col]] or invalid_present[code_index[j_col], code_index[i_col]]),
+                    'observed_shape': drop_empty_margins(get_pair_count_matrix(pair_counts, level_offsets, code_index[i_col], code_index[j_col])).shape,
+                    'stats': stats,
+                }
+            save_manifest(manifest_path, get_cohort_manifest())
+
+    report.count('pairs_failed', sum(isinstance(pair_manifests[pair]['stats'], str) for pair in pairs))
+    # The manifest keeps every pair's stats, so changing the filter doesn't need them recomputed
+    with report.stage('filter_pairs'):
+        kept_pairs, adjusted_p_values = filter_pairs(pairs, pair_manifests, column_nodes, report)
+    with report.stage('write_build'):
+        write_build_files(data_id, icees_cohort_identifier, columns, column_nodes, pair_manifests, kept_pairs, adjusted_p_values, progress=progress, report=report)
+
+    save_manifest(manifest_path, get_cohort_manifest())
+
+    return data_id
+
+
+def process_pooled_cohorts(data_ids, features, resolved_nodes, dataset_name, now_string, progress=True, pair_workers=1):
+    """Compute the build files for several cohorts pooled together.
+
+    The saved count tables of the cohorts are summed, so no patient rows are read.
+    2x2 pairs also get a Cochran-Mantel-Haenszel test with the cohorts as strata.
+    Returns the pooled id and the report of its stages and counters.
+    """
+    report = RunReport()
+    years = [data_id.split('_')[4] for data_id in data_ids]
+    pooled_id = f"{'_'.join(data_ids[0].split('_')[:4])}_{'-'.join(years)}"
+    icees_cohort_identifier = f"{pooled_id}|{dataset_name}|{'-'.join(years)}|{now_string}"
+
+    count_tables = []
+    for data_id in data_ids:
+        tables = load_count_tables(f'../build/count_tables/{data_id}')
+        if tables is None:
+            raise FileNotFoundError(f'{data_id} has no count tables, run it without --pool first')
+        count_tables.append(tables)
+
+    # Only columns encoded the same way in every cohort can be summed
+    data_column_info = get_data_column_info(count_tables[0]['columns'], features)
+    columns = []
+    for column, column_info in data_column_info.items():
+        column_hash = get_column_info_hash(column_info)
+        if all(dict(zip(tables['columns'], tables['column_hashes'])).get(column) == column_hash for tables in count_tables):
+            columns.append((column, column_info))
+        else:
+            LOGGER.warning(f'Not pooling {column}, it is missing or encoded differently in some cohorts')
+
+    cohort_pair_counts, cohort_invalid_present, cohort_n_values, column_levels = get_aligned_count_tables(count_tables, [column for column, _ in columns])
+    n_levels = [len(levels) for levels in column_levels]
+    pair_counts = np.sum(cohort_pair_counts, axis=0)
+    invalid_present = np.sum(cohort_invalid_present, axis=0)
+    n_values = np.sum(cohort_n_values, axis=0)
+
+    useful_cols, code_index, column_nodes, pairs = get_feature_pairs(columns, n_values, resolved_nodes)
+
+    LOGGER.info(f'Computing pooled feature pair stats for {len(pairs)} pairs...')
+    pair_counts, invalid_present = select_feature_counts(pair_counts, invalid_present, n_levels, useful_cols)
+    level_offsets = get_level_offsets([n_levels[i_col] for i_col in useful_cols])
+    cohort_pair_counts = np.stack([
+        select_feature_counts(counts, cohort_invalid, n_levels, useful_cols)[0]
+        for counts, cohort_invalid in zip(cohort_pair_counts, cohort_invalid_present)
+    ])
+    with report.stage('pair_stats'):
+        pair_stats = compute_all_pair_stats(
+            pair_counts,
+            level_offsets,
+            code_index,
+            pairs,
+            [column_info for _, column_info in columns],
+            workers=pair_workers,
+        )
+    report.count('pairs_computed', len(pairs))
+    pair_manifests = {
+        (i_col, j_col): {
+            'count_errors': bool(invalid_present[code_index[i_col], code_index[j_col]] or invalid_present[code_index[j_col], code_index[i_col]]),
+            'observed_shape': drop_empty_margins(get_pair_count_matrix(pair_counts, level_offsets, code_index[i_col], code_index[j_col])).shape,
+            'stats': stats,
+        }
+        for (i_col, j_col), stats in zip(pairs, pair_stats)
+    }
+
+    # stratify the 2x2 tables by cohort
+    cmh_pairs = [pair for pair in pairs if n_levels[pair[0]] == 2 and n_levels[pair[1]] == 2 and not isinstance(pair_manifests[pair]['stats'], str)]
+    if cmh_pairs:
+        strata = np.stack([
+            np.stack([
+                get_pair_count_matrix(cohort_counts, level_offsets, code_index[i_col], code_index[j_col])
+                for cohort_counts in cohort_pair_counts
+            ])
+            for i_col, j_col in cmh_pairs
+        ])
+        cmh_statistics, cmh_p_values, cmh_odds_ratios = get_batched_cmh(strata)
+        for k, pair in enumerate(cmh_pairs):
+            pair_manifests[pair]['stats'][1].update({
+                'cmh_statistic': cmh_statistics[k],
+                'cmh_p': cmh_p_values[k],
+                'cmh_odds_ratio': cmh_odds_ratios[k],
+            })
+
+    with report.stage('filter_pairs'):
+        kept_pairs, adjusted_p_values = filter_pairs(pairs, pair_manifests, column_nodes, report)
+    with report.stage('write_build'):
+        # kept apart from the per-year build files of the same patients, which massage.py releases by default
+        os.makedirs('../build/pooled', exist_ok=True)
+        write_build_files(pooled_id, icees_cohort_identifier, columns, column_nodes, pair_manifests, kept_pairs, adjusted_p_values, progress=progress, report=report, build_dir='../build/pooled')
+
+    return pooled_id, report.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute ICEES KG nodes and edges for every cohort.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of cohorts processed in parallel.')
+    parser.add_argument('--pair-workers', type=int, default=1, help='Number of processes computing feature pair stats within each cohort.')
+    parser.add_argument('--clean', action='store_true', help='Recompute every feature pair instead of reusing unchanged stats from the build manifests.')
+    parser.add_argument('--resume', action='store_true', help='Pick up the last run from its checkpoint.')
+    parser.add_argument('--profile', metavar='DIR', help='Write cProfile stats of the run and of every cohort to this folder.')
+    parser.add_argument('--pool', nargs='*', metavar='YEAR', help='Pool the saved count tables of the cohorts of these years, or all years, into one set of edges.')
+    args = parser.parse_args()
+
+    now = datetime.now()
+    now_string = now.strftime('%Y_%m_%d_%H_%M_%S')
+    setup_logging(f'icees_kg_{now_string}')
+    report_path = f"{Path(__file__).parent.parent.resolve()}/logs/icees_kg_{now_string}_report.json"
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+
+    run_report = RunReport()
+    cohort_reports = {}
+    failed_cohorts = []
+    try:
+        with run_report.stage('total'), profiled(args.profile and f'{args.profile}/main.prof'):
+            run(args, now_string, run_report, cohort_reports, failed_cohorts)
+    finally:
+        for cohort_report in cohort_reports.values():
+            run_report.add_counters(cohort_report['counters'])
+        save_run_report(report_path, {
+            'started': now.isoformat(timespec='seconds'),
+            'finished': datetime.now().isoformat(timespec='seconds'),
+            'args': vars(args),
+            **run_report.to_dict(),
+            'cohorts': cohort_reports,
+            'failed_cohorts': failed_cohorts,
+        })
+        LOGGER.info(f'Wrote run report {report_path}')
+
+
+def load_checkpoint(checkpoint_path, features_hash, csv_hashes):
+    """Load the checkpoint of an unfinished run on the same inputs, {} if there's none to resume."""
+    checkpoint = load_manifest(checkpoint_path)
+    if not checkpoint:
+        LOGGER.warning('No checkpoint found, starting a new run')
+        return {}
+    if checkpoint.get('finished'):
+        LOGGER.warning(f"Run {checkpoint['now_string']} already finished, starting a new run")
+        return {}
+    # cohorts built from other inputs can't be mixed with the rest of the run
+    changed_cohorts = [data_id for data_id in checkpoint['done'] if checkpoint.get('csv_hashes', {}).get(data_id) != csv_hashes.get(data_id)]
+    if checkpoint.get('features_hash') != features_hash or changed_cohorts:
+        changed_inputs = ', '.join((['features yaml'] if checkpoint.get('features_hash') != features_hash else []) + changed_cohorts)
+        LOGGER.warning(f"Inputs of run {checkpoint['now_string']} changed since it was checkpointed ({changed_inputs}), starting a new run")
+        return {}
+    return checkpoint
+
+
+def run(args, now_string, run_report, cohort_reports, failed_cohorts):
+    """Build every cohort, or the pooled cohorts, recording their reports."""
+
+    data_path = os.getenv('DATA_PATH', None)
+    assert data_path is not None, 'An environment variable called DATA_PATH is required.'
+    data_csvs = sorted(Path(data_path).glob('*.csv'))
+
+    features_yml = os.getenv('FEATURES_YAML', None)
+    assert features_yml is not None, 'An environment variable called FEATURES_YAML is required.'
+
+    dataset_name = os.getenv('DATASET_NAME', None)
+    assert dataset_name is not None, 'An environment variable called DATASET_NAME is required.'
+
+    assert edge_p_value_correction in P_VALUE_CORRECTIONS, f'EDGE_P_VALUE_CORRECTION must be one of {", ".join(P_VALUE_CORRECTIONS)}.'
+    assert build_compression in COMPRESSIONS, f'BUILD_COMPRESSION must be one of {", ".join(COMPRESSIONS)}.'
+
+    # create output folder
+    if not os.path.exists('../build'):
+        os.makedirs('../build')
+    clean = args.clean
+    if args.pool is None:
+        # Finished cohorts of the current run and the inputs they were built from, so it can be resumed
+        checkpoint_path = '../build/checkpoint.json'
+        with run_report.stage('hash_inputs'), ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+            features_hash = get_file_hash(features_yml)
+            csv_hashes = dict(zip([data_csv.stem for data_csv in data_csvs], executor.map(get_file_hash, data_csvs)))
+        checkpoint = load_checkpoint(checkpoint_path, features_hash, csv_hashes) if args.resume else {}
+        if checkpoint:
+            # keep the run's timestamp so every cohort gets the same identifier
+            now_string = checkpoint['now_string']
+            LOGGER.info(f"Resuming run {now_string}, {len(checkpoint['done'])} cohorts already done")
+            if clean:
+                LOGGER.warning('Ignoring --clean while resuming, the stats checkpointed by the interrupted run are reused')
+            # stats checkpointed in the manifests by the interrupted run are always reused
+            clean = False
+        else:
+            checkpoint = {'now_string': now_string, 'features_hash': features_hash, 'csv_hashes': csv_hashes, 'done': [], 'finished': False}
+            save_manifest(checkpoint_path, checkpoint)
+        data_csvs = [data_csv for data_csv in data_csvs if data_csv.stem not in checkpoint['done']]
+    LOGGER.info(f'Running precompute for dataset: {dataset_name}')
+    LOGGER.info('Loading data files...')
+
+    with open(features_yml, 'r') as f:
+        full_features = yaml.safe_load(f)
+        features = full_features['patient']
+
+    LOGGER.info('Resolving feature search terms...')
+    with run_report.stage('resolve_features'):
+        resolved_nodes = resolve_features(features)
+    run_report.add_counters(lookup_counters)
+
+    if args.pool is not None:
+        data_ids = [data_csv.stem for data_csv in data_csvs if not args.pool or data_csv.stem.split('_')[4] in args.pool]
+        assert data_ids, 'No cohorts to pool.'
+        LOGGER.info(f'Pooling {", ".join(data_ids)}')
+        with run_report.stage('cohorts'):
+            pooled_id, cohort_reports[pooled_id] = process_pooled_cohorts(data_ids, features, resolved_nodes, dataset_name, now_string, pair_workers=args.pair_workers)
+        LOGGER.info(f'Finished {pooled_id}')
+        LOGGER.info('All done!')
+        return
+
+    with run_report.stage('cohorts'):
+        if args.workers > 1:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(now_string,)) as executor:
+                futures = {
+                    executor.submit(process_cohort, data_csv, features, resolved_nodes, dataset_name, now_string, progress=False, pair_workers=args.pair_workers, clean=clean, profile_dir=args.profile, csv_hash=csv_hashes[data_csv.stem]): data_csv
+                    for data_csv in data_csvs
+                }
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    data_csv = futures[future]
+                    try:
+                        data_id, cohort_reports[data_id] = future.result()
+                        LOGGER.info(f'Finished {data_id}')
+                    except Exception as e:
+                        LOGGER.exception(f'Failed to process {data_csv.stem}: {e!r}')
+                        failed_cohorts.append(data_csv.stem)
+                        continue
+                    checkpoint['done'].append(data_id)
+                    save_manifest(checkpoint_path, checkpoint)
+        else:
+            for data_csv in tqdm(data_csvs):
+                try:
+                    data_id, cohort_reports[data_id] = process_cohort(data_csv, features, resolved_nodes, dataset_name, now_string, pair_workers=args.pair_workers, clean=clean, profile_dir=args.profile, csv_hash=csv_hashes[data_csv.stem])
+                except Exception as e:
+                    LOGGER.exception(f'Failed to process {data_csv.stem}: {e!r}')
+                    failed_cohorts.append(data_csv.stem)
+                    continue
+                checkpoint['done'].append(data_id)
+                save_manifest(checkpoint_path, checkpoint)
 
-        # for each node captured
-        for node in node_list:
-            # write out the node
-            file_writer.write_kgx_node(node)
+    if failed_cohorts:
+        LOGGER.error(f'Failed cohorts: {", ".join(failed_cohorts)}')
+    else:
+        # a finished run is never resumed
+        checkpoint['finished'] = True
+        save_manifest(checkpoint_path, checkpoint)
+    LOGGER.info('All done!')
 
-    orphan_nodes_removed = remove_unconnected_nodes(nodes_output_file_path, edges_output_file_path)
 
-LOGGER.info('All done!')
+if __name__ == '__main__':
+    main()
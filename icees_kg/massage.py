@@ -1,144 +1,323 @@
-import glob
-import json
-import jsonlines
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import tempfile
+import zlib
+
+from utils.compression import COMPRESSIONS, ChecksumFile, CompressedWriter, get_compressed_path, glob_compressed, open_input, remove_other_compressions
+from utils.json_codec import loads, dumps
+from utils.manifest import save_manifest
+from utils.release_index import build_release_index
+from utils.pair_records import get_curies_path, load_feature_curies, iter_pair_edges
 
 
-edge_files = glob.glob("build/*_edges.jsonl")
-node_files = glob.glob("build/*_nodes.jsonl")
 release_version = "1.5.0"
 
-jsonl = []
-edges = {}
-for file in edge_files:
-    with jsonlines.open(file) as reader:
-        for line in reader:
-            edge_id = f"{line['subject']}-{line['predicate']}>{line['object']}"
-            edges[edge_id] = edges.get(edge_id, {
-                "subject": line["subject"],
-                "predicate": line["predicate"],
-                "object": line["object"],
-                "attributes": [
-                    {
-                        "attribute_type_id": "biolink:primary_knowledge_source",
-                        "value": line["biolink:primary_knowledge_source"],
-                    },
-                    {
-                        "attribute_type_id": "biolink:has_supporting_study_result",
-                        "value": line["biolink:has_supporting_study_result"],
-                    },
-                    {
-                        "attribute_type_id": "terms_and_conditions_of_use",
-                        "value": line["terms_and_conditions_of_use"],
-                    },
-                    {
-                        "attribute_type_id": "subject_feature_name",
-                        "value": line["subject_feature_name"],
-                    },
-                    {
-                        "attribute_type_id": "object_feature_name",
-                        "value": line["object_feature_name"],
-                    },
-                ],
-            })
-            exists = False
-            for attribute in edges[edge_id]["attributes"]:
-                if attribute["attribute_type_id"] == line["icees_cohort_identifier"]:
-                    exists = True
-                    attribute["attributes"] += [
-                        {
-                            "attribute_type_id": "chi_squared_statistic",
-                            "value": line["chi_squared_statistic"],
-                        },
-                        {
-                            "attribute_type_id": "chi_squared_dof",
-                            "value": line["chi_squared_dof"],
-                        },
-                        {
-                            "attribute_type_id": "chi_squared_p",
-                            "value": line["chi_squared_p"],
-                        },
-                        {
-                            "attribute_type_id": "total_sample_size",
-                            "value": line["total_sample_size"],
-                        },
-                    ]
-                    if "fisher_exact_odds_ratio" in line:
-                        attribute["attributes"] += [
-                            {
-                                "attribute_type_id": "fisher_exact_odds_ratio",
-                                "value": line["fisher_exact_odds_ratio"],
-                            },
-                            {
-                                "attribute_type_id": "fisher_exact_p",
-                                "value": line["fisher_exact_p"],
-                            },
-                            {
-                                "attribute_type_id": "log_odds_ratio",
-                                "value": line["log_odds_ratio"],
-                            },
-                            {
-                                "attribute_type_id": "log_odds_ratio_95_ci",
-                                "value": line["log_odds_ratio_95_ci"],
-                            },
-                        ]
-            if not exists:
-                attributes = [
-                    {
-                        "attribute_type_id": "chi_squared_statistic",
-                        "value": line["chi_squared_statistic"],
-                    },
-                    {
-                        "attribute_type_id": "chi_squared_dof",
-                        "value": line["chi_squared_dof"],
-                    },
-                    {
-                        "attribute_type_id": "chi_squared_p",
-                        "value": line["chi_squared_p"],
-                    },
-                    {
-                        "attribute_type_id": "total_sample_size",
-                        "value": line["total_sample_size"],
-                    },
-                ]
-                if "fisher_exact_odds_ratio" in line:
-                    attributes += [
-                        {
-                            "attribute_type_id": "fisher_exact_odds_ratio",
-                            "value": line["fisher_exact_odds_ratio"],
-                        },
-                        {
-                            "attribute_type_id": "fisher_exact_p",
-                            "value": line["fisher_exact_p"],
-                        },
-                        {
-                            "attribute_type_id": "log_odds_ratio",
-                            "value": line["log_odds_ratio"],
-                        },
-                        {
-                            "attribute_type_id": "log_odds_ratio_95_ci",
-                            "value": line["log_odds_ratio_95_ci"],
-                        },
-                    ]
-                edges[edge_id]["attributes"].append({
-                    "attribute_type_id": "icees_cohort_identifier",
-                    "value": line["icees_cohort_identifier"],
-                    "attributes": attributes,
-                })
-for edge in edges.values():
-    edge["attributes"] = json.dumps(edge["attributes"])
-    jsonl.append(edge)
-
-with jsonlines.open(f"releases/{release_version}/edges.jsonl", "w") as writer:
-  writer.write_all(jsonl)
-
-ids = set()
-jsonl = []
-for file in node_files:
-  with jsonlines.open(file) as reader:
-    for line in reader:
-      if line["id"] not in ids:
-        ids.add(line["id"])
-        jsonl.append(line)
-
-with jsonlines.open(f"releases/{release_version}/nodes.jsonl", "w") as writer:
-  writer.write_all(jsonl)
+
+def get_edge_key(line):
+    """Get the key that edges are merged on."""
+    return f"{line['subject']}-{line['predicate']}>{line['object']}"
+
+
+def get_node_key(line):
+    """Get the key that nodes are deduplicated on."""
+    return line["id"]
+
+
+def get_edge(line):
+    """Get a release edge with the shared attributes of an edge line."""
+    return {
+        "subject": line["subject"],
+        "predicate": line["predicate"],
+        "object": line["object"],
+        "attributes": [
+            {
+                "attribute_type_id": "biolink:primary_knowledge_source",
+                "value": line["biolink:primary_knowledge_source"],
+            },
+            {
+                "attribute_type_id": "biolink:has_supporting_study_result",
+                "value": line["biolink:has_supporting_study_result"],
+            },
+            {
+                "attribute_type_id": "terms_and_conditions_of_use",
+                "value": line["terms_and_conditions_of_use"],
+            },
+            {
+                "attribute_type_id": "subject_feature_name",
+                "value": line["subject_feature_name"],
+            },
+            {
+                "attribute_type_id": "object_feature_name",
+                "value": line["object_feature_name"],
+            },
+        ],
+    }
+
+
+def get_cohort_attribute(line):
+    """Get the cohort attribute with the stats of a pair record or edge line."""
+    attributes = [
+        {
+            "attribute_type_id": "chi_squared_statistic",
+            "value": line["chi_squared_statistic"],
+        },
+        {
+            "attribute_type_id": "chi_squared_dof",
+            "value": line["chi_squared_dof"],
+        },
+        {
+            "attribute_type_id": "chi_squared_p",
+            "value": line["chi_squared_p"],
+        },
+        {
+            "attribute_type_id": "total_sample_size",
+            "value": line["total_sample_size"],
+        },
+    ]
+    if "chi_squared_p_adjusted" in line:
+        attributes.append({
+            "attribute_type_id": "chi_squared_p_adjusted",
+            "value": line["chi_squared_p_adjusted"],
+        })
+    if "fisher_exact_odds_ratio" in line:
+        attributes += [
+            {
+                "attribute_type_id": "fisher_exact_odds_ratio",
+                "value": line["fisher_exact_odds_ratio"],
+            },
+            {
+                "attribute_type_id": "fisher_exact_p",
+                "value": line["fisher_exact_p"],
+            },
+            {
+                "attribute_type_id": "log_odds_ratio",
+                "value": line["log_odds_ratio"],
+            },
+            {
+                "attribute_type_id": "log_odds_ratio_95_ci",
+                "value": line["log_odds_ratio_95_ci"],
+            },
+        ]
+    if "cmh_statistic" in line:
+        attributes += [
+            {
+                "attribute_type_id": "cmh_statistic",
+                "value": line["cmh_statistic"],
+            },
+            {
+                "attribute_type_id": "cmh_p",
+                "value": line["cmh_p"],
+            },
+            {
+                "attribute_type_id": "cmh_odds_ratio",
+                "value": line["cmh_odds_ratio"],
+            },
+        ]
+    return {
+        "attribute_type_id": "icees_cohort_identifier",
+        "value": line["icees_cohort_identifier"],
+        "attributes": attributes,
+    }
+
+
+def get_spill_path(spill_dir, prefix, i_file, partition):
+    """Get the spill file of one input file's lines in one partition."""
+    return os.path.join(spill_dir, f"{prefix}_{i_file}_{partition}.jsonl")
+
+
+def partition_file(file, i_file, get_key, n_partitions, spill_dir, prefix):
+    """Spill the lines of a jsonl file into n_partitions files by the hash of their key.
+
+    Lines keep their order within a partition.
+    """
+    partition_files = [open(get_spill_path(spill_dir, prefix, i_file, k), "wb") for k in range(n_partitions)]
+    try:
+        with open_input(file) as f:
+            for raw_line in f:
+                if not raw_line.strip():
+                    continue
+                key = get_key(loads(raw_line))
+                partition = zlib.crc32(key.encode()) % n_partitions
+                partition_files[partition].write(raw_line if raw_line.endswith(b"\n") else raw_line + b"\n")
+    finally:
+        for partition_file in partition_files:
+            partition_file.close()
+
+
+def partition_node_file(file, i_file, n_partitions, spill_dir):
+    """Spill the node lines of a build nodes file into partitions by id."""
+    partition_file(file, i_file, get_node_key, n_partitions, spill_dir, "nodes")
+
+
+def partition_pairs_file(file, i_file, n_partitions, spill_dir):
+    """Expand the pair records of a build pairs file into edges, spilled into partitions by their key.
+
+    A partition gets the pair record line before the first of its edges, and the edges
+    that follow a pair record are its edges. Edge lines are just their tab separated curies.
+    """
+    feature_curies = load_feature_curies(get_curies_path(file))
+    partition_files = [open(get_spill_path(spill_dir, "edges", i_file, k), "wb") for k in range(n_partitions)]
+    try:
+        with open_input(file) as f:
+            for raw_line in f:
+                if not raw_line.strip():
+                    continue
+                record = loads(raw_line)
+                pair_partitions = set()
+                for subject_id, object_id in iter_pair_edges(record, feature_curies):
+                    edge_key = get_edge_key({"subject": subject_id, "predicate": record["predicate"], "object": object_id})
+                    partition = zlib.crc32(edge_key.encode()) % n_partitions
+                    if partition not in pair_partitions:
+                        pair_partitions.add(partition)
+                        partition_files[partition].write(raw_line if raw_line.endswith(b"\n") else raw_line + b"\n")
+                    partition_files[partition].write(f"{subject_id}\t{object_id}\n".encode())
+    finally:
+        for partition_file in partition_files:
+            partition_file.close()
+
+
+def iter_spill_lines(spill_dir, prefix, i_file, partition):
+    """Get the raw lines of one input file's spill file in a partition, deleting it."""
+    path = get_spill_path(spill_dir, prefix, i_file, partition)
+    with open(path, "rb") as f:
+        yield from f
+    os.remove(path)
+
+
+def iter_partition_lines(spill_dir, prefix, n_files, partition):
+    """Get the lines of a partition in input file order, deleting its spill files."""
+    for i_file in range(n_files):
+        for raw_line in iter_spill_lines(spill_dir, prefix, i_file, partition):
+            yield loads(raw_line)
+
+
+def merge_edge_partition(spill_dir, n_files, partition, output_compression):
+    """Merge the edge lines of a partition into release edges in its compressed output file.
+
+    Every pair record is parsed once, however many edges it stands for.
+    Returns the output file and its number of lines.
+    """
+    edges = {}
+    for i_file in range(n_files):
+        for raw_line in iter_spill_lines(spill_dir, "edges", i_file, partition):
+            if raw_line.startswith(b"{"):
+                record = loads(raw_line)
+                cohort_attribute = get_cohort_attribute(record)
+                continue
+            subject_id, object_id = raw_line.decode().rstrip("\n").split("\t")
+            line = {"subject": subject_id, "predicate": record["predicate"], "object": object_id}
+            edge_id = get_edge_key(line)
+            if edge_id not in edges:
+                edges[edge_id] = get_edge({**record, **line})
+            edges[edge_id]["attributes"].append(cohort_attribute)
+    output_path = os.path.join(spill_dir, f"edges_{partition}.out")
+    with CompressedWriter(output_path, *output_compression) as f:
+        for edge in edges.values():
+            edge["attributes"] = dumps(edge["attributes"])
+            f.write(f"{dumps(edge)}\n".encode())
+    return output_path, f.lines
+
+
+def merge_node_partition(spill_dir, n_files, partition, output_compression):
+    """Write the first node line for every id of a partition to its compressed output file.
+
+    Returns the output file and its number of lines.
+    """
+    ids = set()
+    output_path = os.path.join(spill_dir, f"nodes_{partition}.out")
+    with CompressedWriter(output_path, *output_compression) as f:
+        for line in iter_partition_lines(spill_dir, "nodes", n_files, partition):
+            if line["id"] not in ids:
+                ids.add(line["id"])
+                f.write(f"{dumps(line)}\n".encode())
+    return output_path, f.lines
+
+
+def merge_files(files, partition, merge_partition, output_file_path, output_compression, n_partitions, spill_dir, executor):
+    """Hash-partition files, merge every partition and concatenate them in partition order.
+
+    Partitions are compressed by the process that merges them. Concatenated gzip members
+    or zstd frames are a valid gzip or zstd file. Returns the output file's info.
+    """
+    map_fn = executor.map if executor else map
+    list(map_fn(
+        partition,
+        files,
+        range(len(files)),
+        [n_partitions] * len(files),
+        [spill_dir] * len(files),
+    ))
+    outputs = map_fn(
+        merge_partition,
+        [spill_dir] * n_partitions,
+        [len(files)] * n_partitions,
+        range(n_partitions),
+        [output_compression] * n_partitions,
+    )
+    lines = 0
+    with open(output_file_path, "wb") as output_file:
+        checksum_file = ChecksumFile(output_file)
+        for output_path, output_lines in outputs:
+            with open(output_path, "rb") as f:
+                shutil.copyfileobj(f, checksum_file)
+            os.remove(output_path)
+            lines += output_lines
+    return {
+        "compression": output_compression[0],
+        "sha256": checksum_file.sha256.hexdigest(),
+        "bytes": checksum_file.size,
+        "lines": lines,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the build edges and nodes of every cohort into a release.')
+    parser.add_argument('--partitions', type=int, default=64, help='Number of spill files the edges and nodes are hashed into.')
+    parser.add_argument('--tmp-dir', default=None, help='Where to put the spill files.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes partitioning and merging in parallel.')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none', help='Compression of the release files.')
+    parser.add_argument('--compression-level', type=int, default=0, help='Compression level, 0 for the default of the compression.')
+    parser.add_argument('--compression-threads', type=int, default=0, help='Threads compressing each zstd partition, on top of --workers.')
+    parser.add_argument('--index', action='store_true', help='Also write an sqlite index of the release, for lookups and verify_release.py.')
+    parser.add_argument('--pooled', action='store_true', help='Release the pooled cohorts of main.py --pool into releases/<version>/pooled instead of the per-year cohorts.')
+    args = parser.parse_args()
+
+    build_dir = "build/pooled" if args.pooled else "build"
+    release_path = f"releases/{release_version}/pooled" if args.pooled else f"releases/{release_version}"
+    # build files are read whether or not they are compressed
+    pairs_files = glob_compressed(f"{build_dir}/*_pairs.jsonl")
+    node_files = glob_compressed(f"{build_dir}/*_nodes.jsonl")
+    os.makedirs(release_path, exist_ok=True)
+    output_compression = (args.compression, args.compression_level, args.compression_threads)
+    release_files = {}
+
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        with tempfile.TemporaryDirectory(dir=args.tmp_dir) as spill_dir:
+            for name, files, partition, merge_partition in [
+                ("edges.jsonl", pairs_files, partition_pairs_file, merge_edge_partition),
+                ("nodes.jsonl", node_files, partition_node_file, merge_node_partition),
+            ]:
+                output_file_path = get_compressed_path(f"{release_path}/{name}", args.compression)
+                release_files[os.path.basename(output_file_path)] = merge_files(
+                    files, partition, merge_partition, output_file_path, output_compression, args.partitions, spill_dir, executor,
+                )
+                remove_other_compressions(f"{release_path}/{name}", args.compression)
+    finally:
+        if executor:
+            executor.shutdown()
+    # checksums and line counts, to check the release after uploading it
+    save_manifest(f"{release_path}/manifest.json", release_files)
+    index_path = f"{release_path}/index.sqlite"
+    if args.index:
+        edges_file, nodes_file = release_files
+        build_release_index(release_path, edges_file, nodes_file, index_path)
+    elif os.path.exists(index_path):
+        # the offsets of an older index don't match the new files
+        os.remove(index_path)
+
+
+if __name__ == "__main__":
+    main()
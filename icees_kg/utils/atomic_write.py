@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+import os
+import shutil
+
+
+def remove_path(path):
+    """Remove a file or folder if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def atomic_path(path):
+    """Get a temporary path to write a file or folder to, which replaces path once the block succeeds.
+
+    Readers of path see either the old or the new contents, never a partial write.
+    The temporary path is removed if the block fails.
+    """
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    remove_path(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.isdir(tmp_path):
+            # a folder can only replace an empty one
+            remove_path(path)
+        os.replace(tmp_path, path)
+    finally:
+        remove_path(tmp_path)
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """Open a file to write that replaces path once the block succeeds, see atomic_path."""
+    with atomic_path(path) as tmp_path, open(tmp_path, mode) as f:
+        yield f
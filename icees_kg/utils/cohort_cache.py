@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+
+LOGGER = logging.getLogger(__name__)
+
+# Bump when the encoding changes so old caches are not reused
+ENCODING_VERSION = 1
+
+
+def get_file_hash(file_path):
+    """Get the sha256 of a file's contents."""
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_column_info_hash(column_info):
+    """Get a hash of the parts of a column's info that change its encoding."""
+    encoding_info = {
+        'name': column_info['name'],
+        'enum': column_info['enum'],
+        'min': column_info['min'],
+        'max': column_info['max'],
+        'is_integer': column_info['is_integer'],
+    }
+    if column_info.get('bins'):
+        # only binned columns hash their bins, so unbinned columns keep their hash
+        encoding_info['bins'] = column_info['bins']
+    return hashlib.sha256(json.dumps(encoding_info, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_cohort_cache_key(csv_hash, data_columns, data_column_info):
+    """Get the cache key of a cohort csv encoded with data_column_info."""
+    key = {
+        'version': ENCODING_VERSION,
+        'csv': csv_hash,
+        'data_columns': data_columns,
+        'columns': [get_column_info_hash(column_info) for column_info in data_column_info.values()],
+    }
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def load_encoded_cohort(cache_path, cache_key):
+    """Memory-map a cached encoded cohort.
+
+    Returns the codes and the cache metadata, or None if it is not cached.
+    """
+    cohort_path = Path(cache_path) / cache_key
+    try:
+        with open(cohort_path / 'meta.json', 'r') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    shape = (meta['n_rows'], len(meta['columns']))
+    if not shape[0] or not shape[1]:
+        return np.empty(shape, dtype=meta['dtype']), meta
+    codes = np.memmap(cohort_path / 'codes.bin', dtype=meta['dtype'], mode='r', shape=shape)
+    return codes, meta
+
+
+class EncodedCohortWriter:
+    """Write an encoded cohort to the cache a chunk at a time.
+
+    The cache entry only appears once the writer exits without an error.
+    """
+
+    def __init__(self, cache_path, cache_key, columns, dtype):
+        self.cohort_path = Path(cache_path) / cache_key
+        self.tmp_path = Path(cache_path) / f'{cache_key}.tmp{os.getpid()}'
+        self.meta = {
+            'columns': columns,
+            'dtype': np.dtype(dtype).name,
+            'n_rows': 0,
+            'unknown_values': {},
+        }
+        self.codes_file = None
+
+    def __enter__(self):
+        self.tmp_path.mkdir(parents=True, exist_ok=True)
+        self.codes_file = open(self.tmp_path / 'codes.bin', 'wb')
+        return self
+
+    def write(self, codes, unknown_values):
+        """Append a chunk of encoded rows."""
+        self.codes_file.write(np.ascontiguousarray(codes, dtype=self.meta['dtype']).tobytes())
+        self.meta['n_rows'] += len(codes)
+        for column, values in unknown_values.items():
+            column_unknown_values = self.meta['unknown_values'].setdefault(column, {})
+            for value, count in values.items():
+                column_unknown_values[value] = column_unknown_values.get(value, 0) + count
+
+    def write_chunks(self, chunks):
+        """Write chunks of (codes, unknown_values) while passing them on."""
+        for codes, unknown_values in chunks:
+            self.write(codes, unknown_values)
+            yield codes, unknown_values
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.codes_file.close()
+        if exc_type is None:
+            with open(self.tmp_path / 'meta.json', 'w') as f:
+                json.dump(self.meta, f)
+            try:
+                os.rename(self.tmp_path, self.cohort_path)
+            except OSError:
+                # another process cached this cohort first
+                LOGGER.info(f'{self.cohort_path} is already cached')
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
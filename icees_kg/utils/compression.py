@@ -0,0 +1,134 @@
+"""Streaming gzip and zstd compression of jsonl files, with the checksum and line count of what was written."""
+import glob
+import gzip
+import hashlib
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def get_zstandard():
+    """Get the zstandard module, which zstd files need."""
+    if zstandard is None:
+        raise ImportError('zstd files need the zstandard package, pip install zstandard')
+    return zstandard
+
+
+def get_compressed_path(path, compression):
+    """Get the path of a file compressed with compression."""
+    return f'{path}{COMPRESSION_SUFFIXES[compression]}'
+
+
+def get_uncompressed_path(path):
+    """Get the path of a possibly compressed file without its compression suffix."""
+    path = str(path)
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if suffix and path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def glob_compressed(pattern):
+    """Get the files matching a pattern, compressed or not."""
+    return sorted(path for suffix in COMPRESSION_SUFFIXES.values() for path in glob.glob(f'{pattern}{suffix}'))
+
+
+def remove_other_compressions(path, compression):
+    """Remove copies of a file with any other compression, so only the latest one is read."""
+    for other in COMPRESSIONS:
+        if other != compression and os.path.exists(get_compressed_path(path, other)):
+            os.remove(get_compressed_path(path, other))
+
+
+class ChecksumFile:
+    """A binary file that keeps the sha256 and size of the bytes written to it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class CompressedWriter:
+    """Stream bytes to a file, compressing them, and count their lines and checksum the file.
+
+    gzip is always compressed on one thread, zstd on threads threads (0 for the calling thread only).
+    """
+
+    def __init__(self, path, compression='none', level=None, threads=0):
+        assert compression in COMPRESSIONS, f'Compression must be one of {", ".join(COMPRESSIONS)}.'
+        self.compression = compression
+        self.raw = open(path, 'wb')
+        self.checksum_file = ChecksumFile(self.raw)
+        if compression == 'gzip':
+            # no timestamp in the header, so the same lines always give the same file
+            self.stream = gzip.GzipFile(fileobj=self.checksum_file, mode='wb', compresslevel=level or DEFAULT_COMPRESSION_LEVELS['gzip'], mtime=0)
+        elif compression == 'zstd':
+            compressor = get_zstandard().ZstdCompressor(level=level or DEFAULT_COMPRESSION_LEVELS['zstd'], threads=threads)
+            self.stream = compressor.stream_writer(self.checksum_file, closefd=False)
+        else:
+            self.stream = self.checksum_file
+        self.lines = 0
+
+    def write(self, data):
+        self.lines += data.count(b'\n')
+        self.stream.write(data)
+
+    def close(self):
+        if self.stream is not self.checksum_file:
+            self.stream.close()
+        self.raw.close()
+
+    def get_file_info(self):
+        """Get the compression, checksum, size and line count of the written file."""
+        return {
+            'compression': self.compression,
+            'sha256': self.checksum_file.sha256.hexdigest(),
+            'bytes': self.checksum_file.size,
+            'lines': self.lines,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_input(path):
+    """Open a file to read bytes from, decompressing it if it's gzip or zstd compressed."""
+    with open(path, 'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, 'rb')
+    if magic == ZSTD_MAGIC:
+        # files concatenated from separately compressed parts have several frames
+        reader = get_zstandard().ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.BufferedReader(reader)
+    return open(path, 'rb')
+
+
+def compress_file(input_path, output_path, compression='none', level=None, threads=0):
+    """Copy a file into a compressed one, returning its file info."""
+    with open_input(input_path) as f, CompressedWriter(output_path, compression, level, threads) as writer:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            writer.write(chunk)
+    return writer.get_file_info()
@@ -0,0 +1,301 @@
+import logging
+import numpy as np
+import scipy.special as scispecial
+import scipy.stats as scistats
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_level_offsets(n_levels):
+    """Get the offset of each feature's first level in the one-hot matrix."""
+    return np.concatenate([[0], np.cumsum(n_levels)]).astype(np.int64)
+
+
+def get_observed_levels(codes, column_levels):
+    """Add the codes that occur in a block to the sorted levels of each feature."""
+    observed_levels = []
+    for i_col, levels in enumerate(column_levels):
+        c = codes[:, i_col]
+        column_codes = np.nonzero(np.bincount(c[c >= 0]))[0]
+        observed_levels.append(levels if np.all(np.isin(column_codes, levels)) else np.union1d(levels, column_codes))
+    return observed_levels
+
+
+def get_level_codes(codes, column_levels):
+    """Map the bin codes of a block to the index of their level in column_levels.
+
+    Every code has to be in its feature's levels, missing and invalid codes are kept.
+    """
+    level_codes = codes.copy()
+    for i_col, levels in enumerate(column_levels):
+        # levels 0..n-1 are already their own index
+        if not len(levels) or levels[-1] == len(levels) - 1:
+            continue
+        c = codes[:, i_col]
+        rows = c >= 0
+        level_codes[rows, i_col] = np.searchsorted(levels, c[rows])
+    return level_codes
+
+
+def reindex_pair_counts(counts, column_levels, new_column_levels):
+    """Get a count matrix over column_levels laid out over new_column_levels, which hold them all.
+
+    New levels get zero counts.
+    """
+    offsets = get_level_offsets([len(levels) for levels in new_column_levels])
+    index = np.concatenate([
+        offsets[k] + np.searchsorted(new_levels, levels)
+        for k, (levels, new_levels) in enumerate(zip(column_levels, new_column_levels))
+    ] or [[]]).astype(np.int64)
+    new_counts = np.zeros((offsets[-1], offsets[-1]), dtype=counts.dtype)
+    new_counts[np.ix_(index, index)] = counts
+    return new_counts
+
+
+def one_hot_encode_observed(codes, n_levels):
+    """One-hot encode a block of bin codes over only the levels that occur in it.
+
+    Returns the one-hot matrix and the index of each of its columns in the full
+    one-hot matrix, so wide integer features cost as many columns as they have
+    observed values rather than their declared range.
+    """
+    offsets = get_level_offsets(n_levels)
+    column_rows = []
+    observed = np.zeros(offsets[-1], dtype=bool)
+    for i_col in range(codes.shape[1]):
+        c = codes[:, i_col]
+        rows = np.nonzero(c >= 0)[0]
+        column_codes = c[rows]
+        observed[offsets[i_col]:offsets[i_col + 1]] = np.bincount(column_codes, minlength=n_levels[i_col]) > 0
+        column_rows.append((rows, column_codes))
+    levels = np.nonzero(observed)[0]
+    # the column of each observed level in the compact one-hot matrix
+    compact_index = np.cumsum(observed) - 1
+    one_hot = np.zeros((codes.shape[0], len(levels)), dtype=np.float32)
+    for i_col, (rows, column_codes) in enumerate(column_rows):
+        one_hot[rows, compact_index[offsets[i_col]:offsets[i_col + 1]][column_codes]] = 1
+    return one_hot, levels
+
+
+def get_all_pair_counts(codes, n_levels, block_size=50000):
+    """Get the level co-occurrence counts for every pair of features.
+
+    Returns the (levels, levels) count matrix and the (features, features)
+    matrix of how many rows have an invalid value for the row feature while
+    the col feature is present. Rows are processed block_size at a time.
+    """
+    total_levels = int(np.sum(n_levels))
+    counts = np.zeros((total_levels, total_levels), dtype=np.float64)
+    invalid_present = np.zeros((codes.shape[1], codes.shape[1]), dtype=np.float64)
+    for start in range(0, codes.shape[0], block_size):
+        block = codes[start:start + block_size]
+        one_hot, levels = one_hot_encode_observed(block, n_levels)
+        # float32 products are exact for counts below 2**24, which a block can't exceed
+        block_counts = one_hot.T @ one_hot
+        if len(levels) == total_levels:
+            counts += block_counts
+        else:
+            counts[np.ix_(levels, levels)] += block_counts
+        invalid = (block == -2).astype(np.float32)
+        present = (block != -1).astype(np.float32)
+        invalid_present += invalid.T @ present
+    return counts, invalid_present
+
+
+def get_pair_count_matrix(counts, offsets, i_col, j_col):
+    """Get the count matrix for one pair, x2 (j) on the rows and x1 (i) on the cols."""
+    return counts[offsets[j_col]:offsets[j_col + 1], offsets[i_col]:offsets[i_col + 1]]
+
+
+def drop_empty_margins(count_mat):
+    """Get a count matrix without its all-zero rows and cols, the levels that were never observed together."""
+    count_mat = np.asarray(count_mat)
+    return count_mat[np.ix_(np.any(count_mat, axis=1), np.any(count_mat, axis=0))]
+
+
+def get_batched_chi_squared(count_mats):
+    """Compute chi2_contingency(count_mat + eps, correction=False) for many tables.
+
+    Empty rows and cols are dropped first, so the test and its dof only cover
+    observed levels. Tables are then grouped by shape and each group is computed
+    in one pass. Returns a list of (chi_squared_statistic, chi_squared_p, chi_squared_dof).
+    """
+    eps = np.finfo(np.float32).eps
+    count_mats = [drop_empty_margins(count_mat) for count_mat in count_mats]
+    results = [None] * len(count_mats)
+    shapes = {}
+    for i, count_mat in enumerate(count_mats):
+        shapes.setdefault(count_mat.shape, []).append(i)
+
+    for (n_rows, n_cols), indices in shapes.items():
+        observed = np.stack([count_mats[i] for i in indices]) + eps
+        total = np.sum(observed, axis=(1, 2))
+        row_sums = np.sum(observed, axis=2)
+        col_sums = np.sum(observed, axis=1)
+        expected = row_sums[:, :, None] * col_sums[:, None, :] / total[:, None, None]
+        # a table with nothing in it has no rows or cols left
+        dof = (n_rows - 1) * (n_cols - 1) if n_rows and n_cols else 0
+        if dof == 0:
+            statistics = np.zeros(len(indices))
+            p_values = np.ones(len(indices))
+        else:
+            statistics = np.sum((observed - expected) ** 2 / expected, axis=(1, 2))
+            p_values = scistats.chi2.sf(statistics, dof)
+        for k, i in enumerate(indices):
+            results[i] = (statistics[k], p_values[k], dof)
+
+    return results
+
+
+def select_feature_counts(counts, invalid_present, n_levels, features):
+    """Get the count matrices restricted to a subset of features."""
+    offsets = get_level_offsets(n_levels)
+    levels = np.concatenate([np.arange(offsets[k], offsets[k + 1]) for k in features] or [[]]).astype(np.int64)
+    return counts[np.ix_(levels, levels)], invalid_present[np.ix_(features, features)]
+
+
+# log(k!) for k up to len - 1, grown as bigger tables come in
+_log_factorials = np.zeros(1)
+
+# Relative tolerance for comparing hypergeometric probabilities, above the error of the log-factorial sums
+FISHER_RELATIVE_TOLERANCE = 1e-7
+
+
+def get_log_factorials(n):
+    """Get the cached table of log(k!) for k = 0..n or more."""
+    global _log_factorials
+    if len(_log_factorials) <= n:
+        size = max(n + 1, 2 * len(_log_factorials))
+        _log_factorials = scispecial.gammaln(np.arange(size, dtype=np.float64) + 1)
+    return _log_factorials
+
+
+def get_hypergeom_log_pmf(x, total, n1, n):
+    """Get log hypergeom.pmf(x, total, n1, n) for arrays of parameters, -inf outside the support."""
+    log_factorials = get_log_factorials(int(np.max(total, initial=0)))
+    n2 = total - n1
+    low = np.maximum(0, n - n2)
+    high = np.minimum(n, n1)
+    in_support = (x >= low) & (x <= high)
+    x = np.clip(x, low, high)
+    log_pmf = (
+        log_factorials[n1] - log_factorials[x] - log_factorials[n1 - x]
+        + log_factorials[n2] - log_factorials[n - x] - log_factorials[n2 - n + x]
+        - log_factorials[total] + log_factorials[n] + log_factorials[total - n]
+    )
+    return np.where(in_support, log_pmf, -np.inf)
+
+
+def get_batched_fisher_exact(tables):
+    """Compute fisher_exact(table, alternative='two-sided') for a stack of 2x2 tables.
+
+    Follows scipy: the p-value is the probability of every table with the same
+    margins that is no more likely than the observed one. The other tail starts
+    where the hypergeometric pmf on the far side of the mode drops to the observed
+    pmf, which is found with a binary search run on all tables at once.
+    Returns arrays of odds ratios and p-values.
+    """
+    c = np.asarray(tables).astype(np.int64).reshape(-1, 2, 2)
+    n1 = c[:, 0, 0] + c[:, 0, 1]
+    n2 = c[:, 1, 0] + c[:, 1, 1]
+    n = c[:, 0, 0] + c[:, 1, 0]
+    total = n1 + n2
+    x = c[:, 0, 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds_ratios = np.where(
+            (c[:, 1, 0] > 0) & (c[:, 0, 1] > 0),
+            c[:, 0, 0] * c[:, 1, 1] / (c[:, 1, 0] * c[:, 0, 1]),
+            np.inf,
+        )
+    empty_margin = (n1 == 0) | (n2 == 0) | (n == 0) | (n == total)
+    odds_ratios[empty_margin] = np.nan
+
+    mode = (n + 1) * (n1 + 1) // (total + 2)
+    log_p_exact = get_hypergeom_log_pmf(x, total, n1, n)
+    log_p_mode = get_hypergeom_log_pmf(mode, total, n1, n)
+    log_threshold = log_p_exact + FISHER_RELATIVE_TOLERANCE
+    at_mode = empty_margin | (np.abs(log_p_exact - log_p_mode) <= FISHER_RELATIVE_TOLERANCE)
+    below_mode = x < mode
+
+    # Search the side of the mode opposite x for the last table at least as likely
+    # as the observed one. Invariant: likely_end is at least as likely, unlikely_end isn't.
+    likely_end = mode.copy()
+    unlikely_end = np.where(below_mode, np.minimum(n, n1) + 1, np.maximum(0, n - n2) - 1)
+    while True:
+        searching = ~at_mode & (np.abs(unlikely_end - likely_end) > 1)
+        if not np.any(searching):
+            break
+        mid = (likely_end + unlikely_end) // 2
+        likely = get_hypergeom_log_pmf(mid, total, n1, n) >= log_threshold
+        likely_end = np.where(searching & likely, mid, likely_end)
+        unlikely_end = np.where(searching & ~likely, mid, unlikely_end)
+
+    # hypergeom takes (k, M, n, N) as (x, total, n1, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_values = np.where(
+            below_mode,
+            scistats.hypergeom.cdf(x, total, n1, n) + scistats.hypergeom.sf(likely_end, total, n1, n),
+            scistats.hypergeom.sf(x - 1, total, n1, n) + scistats.hypergeom.cdf(unlikely_end, total, n1, n),
+        )
+    p_values = np.minimum(np.where(at_mode, 1.0, p_values), 1.0)
+    return odds_ratios, p_values
+
+
+def get_batched_odds_ratio_stats(tables, truthy):
+    """Compute the Fisher exact test and odds ratio stats for a stack of 2x2 tables.
+
+    truthy marks the tables of two True/False-like features, whose predicate is
+    positively or negatively correlated when the odds ratio is far enough from 1.
+    Returns a dict of arrays with an entry per table.
+    """
+    tables = np.asarray(tables, dtype=np.float64).reshape(-1, 2, 2)
+    truthy = np.asarray(truthy, dtype=bool)
+    eps = np.finfo(np.float32).eps
+    fisher_exact_odds_ratio, fisher_exact_p = get_batched_fisher_exact(tables)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds_r0 = tables[:, 0, 0] / tables[:, 0, 1]
+        odds_r1 = tables[:, 1, 0] / tables[:, 1, 1]
+        log_odds_ratio = np.log(odds_r0 / odds_r1)
+    se_log_odds_ratio = np.sqrt(
+        1 / (tables[:, 0, 0] + eps) + 1 / (tables[:, 0, 1] + eps) + 1 / (tables[:, 1, 0] + eps) + 1 / (tables[:, 1, 1] + eps)
+    )
+    log_odds_ratio_95_ci = np.stack([
+        log_odds_ratio - 1.96 * se_log_odds_ratio,
+        log_odds_ratio + 1.96 * se_log_odds_ratio,
+    ], axis=1)
+
+    predicate = np.full(len(tables), "biolink:correlated_with", dtype=object)
+    predicate[truthy & (log_odds_ratio < -np.log(1.25))] = "biolink:negatively_correlated_with"
+    predicate[truthy & (log_odds_ratio > np.log(1.25))] = "biolink:positively_correlated_with"
+
+    return {
+        "fisher_exact_odds_ratio": fisher_exact_odds_ratio,
+        "fisher_exact_p": fisher_exact_p,
+        "log_odds_ratio": log_odds_ratio,
+        "log_odds_ratio_95_ci": log_odds_ratio_95_ci,
+        "predicate": predicate,
+    }
+
+
+def get_batched_cmh(tables):
+    """Compute the Cochran-Mantel-Haenszel test for many stratified 2x2 tables.
+
+    tables is (pairs, strata, 2, 2). Strata with fewer than two rows add nothing.
+    Returns arrays of the CMH statistics (without continuity correction), their
+    p-values and the Mantel-Haenszel common odds ratios.
+    """
+    tables = np.asarray(tables, dtype=np.float64)
+    a = tables[..., 0, 0]
+    b = tables[..., 0, 1]
+    c = tables[..., 1, 0]
+    d = tables[..., 1, 1]
+    n = a + b + c + d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.where(n > 0, (a + b) * (a + c) / n, 0)
+        variance = np.where(n > 1, (a + b) * (c + d) * (a + c) * (b + d) / (n * n * (n - 1)), 0)
+        statistics = np.sum(a - expected, axis=1) ** 2 / np.sum(variance, axis=1)
+        odds_ratios = np.sum(np.where(n > 0, a * d / n, 0), axis=1) / np.sum(np.where(n > 0, b * c / n, 0), axis=1)
+    p_values = scistats.chi2.sf(statistics, 1)
+    return statistics, p_values, odds_ratios
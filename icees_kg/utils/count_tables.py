@@ -0,0 +1,112 @@
+import json
+import logging
+import numpy as np
+from pathlib import Path
+
+from utils.atomic_write import atomic_path
+from utils.contingency import get_level_offsets, reindex_pair_counts, select_feature_counts
+
+LOGGER = logging.getLogger(__name__)
+
+# Bump when the store layout changes so old count tables are rewritten
+COUNT_TABLES_VERSION = 2
+
+
+def get_count_dtype(max_count):
+    """Get the smallest unsigned integer dtype that holds every count."""
+    for dtype in [np.uint16, np.uint32]:
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def save_count_tables(count_tables_path, csv_hash, columns, column_hashes, column_infos, column_levels, n_values, pair_counts, invalid_present):
+    """Atomically save a cohort's feature pair count tables.
+
+    The tables are a folder with the (levels, levels) pair counts and (columns, columns)
+    invalid_present matrices as .npy files that can be memory-mapped, and an index.json
+    with the position, level offset, levels and info of every column. The levels are
+    the bin codes the column's rows and cols of the pair counts stand for.
+    Counts are additive, so the tables of several cohorts can be summed without
+    reading their patient rows again.
+    """
+    level_offsets = get_level_offsets([len(levels) for levels in column_levels])
+    index = {
+        'version': COUNT_TABLES_VERSION,
+        'csv_hash': csv_hash,
+        'columns': columns,
+        'column_hashes': column_hashes,
+        'column_index': {
+            column: {
+                'position': k,
+                'level_offset': int(level_offsets[k]),
+                'n_levels': len(column_levels[k]),
+                'levels': [int(level) for level in column_levels[k]],
+                'n_values': int(n_values[k]),
+                'info': column_infos[k],
+            }
+            for k, column in enumerate(columns)
+        },
+    }
+    with atomic_path(count_tables_path) as tmp_path:
+        tmp_path = Path(tmp_path)
+        tmp_path.mkdir(parents=True)
+        np.save(tmp_path / 'pair_counts.npy', pair_counts.astype(get_count_dtype(np.max(pair_counts, initial=0))))
+        np.save(tmp_path / 'invalid_present.npy', invalid_present.astype(get_count_dtype(np.max(invalid_present, initial=0))))
+        with open(tmp_path / 'index.json', 'w') as f:
+            json.dump(index, f, default=str)
+
+
+def load_count_tables_index(count_tables_path):
+    """Load the index of a cohort's count tables, None if they haven't been saved."""
+    try:
+        with open(Path(count_tables_path) / 'index.json', 'r') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    if index.get('version') != COUNT_TABLES_VERSION:
+        return None
+    return index
+
+
+def load_count_tables(count_tables_path):
+    """Memory-map a cohort's count tables, None if they haven't been saved.
+
+    Returns the index with the column_levels, n_levels, n_values, pair_counts and invalid_present arrays added.
+    """
+    index = load_count_tables_index(count_tables_path)
+    if index is None:
+        return None
+    column_index = [index['column_index'][column] for column in index['columns']]
+    index['column_levels'] = [np.array(column['levels'], dtype=np.int64) for column in column_index]
+    index['n_levels'] = np.array([column['n_levels'] for column in column_index], dtype=np.int64)
+    index['n_values'] = np.array([column['n_values'] for column in column_index], dtype=np.float64)
+    index['pair_counts'] = np.load(Path(count_tables_path) / 'pair_counts.npy', mmap_mode='r')
+    index['invalid_present'] = np.load(Path(count_tables_path) / 'invalid_present.npy', mmap_mode='r')
+    return index
+
+
+def get_aligned_count_tables(count_tables, columns):
+    """Get the count tables of several cohorts restricted to the same columns and levels in the same order.
+
+    Each column gets the levels observed in any of the cohorts. Returns the stacked
+    (cohorts, levels, levels) pair counts, the stacked (cohorts, columns, columns)
+    invalid_present matrices, the (cohorts, columns) n_values and the levels of each column.
+    """
+    features = [[tables['column_index'][column]['position'] for column in columns] for tables in count_tables]
+    column_levels = [
+        np.unique(np.concatenate([tables['column_levels'][i_col] for tables, i_col in zip(count_tables, column_features)]))
+        for column_features in zip(*features)
+    ]
+    pair_counts = []
+    invalid_present = []
+    n_values = []
+    for tables, cohort_features in zip(count_tables, features):
+        cohort_pair_counts, cohort_invalid_present = select_feature_counts(
+            tables['pair_counts'], tables['invalid_present'], tables['n_levels'], cohort_features,
+        )
+        cohort_column_levels = [tables['column_levels'][i_col] for i_col in cohort_features]
+        pair_counts.append(reindex_pair_counts(cohort_pair_counts.astype(np.float64), cohort_column_levels, column_levels))
+        invalid_present.append(cohort_invalid_present.astype(np.float64))
+        n_values.append(tables['n_values'][cohort_features])
+    return np.stack(pair_counts), np.stack(invalid_present), np.stack(n_values), column_levels
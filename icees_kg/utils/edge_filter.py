@@ -0,0 +1,62 @@
+import numpy as np
+
+P_VALUE_CORRECTIONS = ['none', 'bonferroni', 'bh']
+
+
+def get_adjusted_p_values(p_values, correction):
+    """Adjust p-values for multiple testing.
+
+    correction is 'none', 'bonferroni' or 'bh' (Benjamini-Hochberg false discovery rate).
+    """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    n_tests = len(p_values)
+    if correction == 'none' or not n_tests:
+        return p_values.copy()
+    if correction == 'bonferroni':
+        return np.minimum(p_values * n_tests, 1.0)
+    if correction == 'bh':
+        order = np.argsort(p_values, kind='stable')
+        ranked = p_values[order] * n_tests / np.arange(1, n_tests + 1)
+        # each adjusted p-value is the smallest of those at its rank or above
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        adjusted = np.empty(n_tests)
+        adjusted[order] = np.minimum(ranked, 1.0)
+        return adjusted
+    raise ValueError(f'Unknown p-value correction {correction}, expected one of {", ".join(P_VALUE_CORRECTIONS)}')
+
+
+def get_cramers_v(chi_squared_statistics, total_sample_sizes, table_shapes):
+    """Get Cramér's V, the chi squared effect size, of count matrices with the given shapes."""
+    chi_squared_statistics = np.asarray(chi_squared_statistics, dtype=np.float64)
+    total_sample_sizes = np.asarray(total_sample_sizes, dtype=np.float64)
+    min_dims = np.array([min(shape) - 1 for shape in table_shapes], dtype=np.float64).reshape(-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cramers_v = np.sqrt(chi_squared_statistics / (total_sample_sizes * min_dims))
+    return np.nan_to_num(cramers_v, nan=0.0, posinf=0.0)
+
+
+def filter_pair_stats(pair_stats, table_shapes, correction='none', max_p_value=1.0, min_sample_size=0, min_cramers_v=0.0, min_abs_log_odds_ratio=0.0):
+    """Pick the feature pairs whose edges are kept.
+
+    pair_stats is a list of edge_stats dicts and table_shapes the shapes of their count matrices.
+    The chi squared p-values are corrected across all pairs, then a pair is kept if its
+    adjusted p-value is at most max_p_value and it meets the sample and effect size thresholds.
+    The log odds ratio threshold only applies to pairs that have one.
+    Returns the adjusted p-values and a boolean keep mask.
+    """
+    if not pair_stats:
+        return np.empty(0), np.empty(0, dtype=bool)
+    chi_squared_p = np.array([edge_stats['chi_squared_p'] for edge_stats in pair_stats], dtype=np.float64)
+    chi_squared_statistics = np.array([edge_stats['chi_squared_statistic'] for edge_stats in pair_stats], dtype=np.float64)
+    total_sample_sizes = np.array([edge_stats['total_sample_size'] for edge_stats in pair_stats], dtype=np.float64)
+    abs_log_odds_ratios = np.array([abs(edge_stats.get('log_odds_ratio', np.inf)) for edge_stats in pair_stats], dtype=np.float64)
+
+    adjusted_p_values = get_adjusted_p_values(chi_squared_p, correction)
+    keep = (
+        (adjusted_p_values <= max_p_value)
+        & (total_sample_sizes >= min_sample_size)
+        & (abs_log_odds_ratios >= min_abs_log_odds_ratio)
+    )
+    if min_cramers_v > 0:
+        keep &= get_cramers_v(chi_squared_statistics, total_sample_sizes, table_shapes) >= min_cramers_v
+    return adjusted_p_values, keep
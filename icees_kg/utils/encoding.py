@@ -0,0 +1,200 @@
+import bisect
+import itertools
+import logging
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+# Code of an empty value
+MISSING_CODE = -1
+# Code of a value outside of the feature's bins
+INVALID_CODE = -2
+
+
+def get_data_column_info(data_columns, features):
+    """Get the column info of every data column that is a usable feature."""
+    data_column_info = dict()
+    for feature, feature_info in features.items():
+
+        # Figure out if this feature is in the data_columns
+        try:
+            feature_column_index = data_columns.index(feature)
+        except ValueError:
+            # This yaml feature is not found in the data csv
+            continue
+
+        if 'name_lookup' not in feature_info:
+            # we need a search term in order to include in kg
+            continue
+
+        # Double check that the features match
+        column = data_columns[feature_column_index]
+        if not column == feature:
+            raise Exception('How did we get here?')
+
+        # Set the current column information
+        if feature_info.get('enum', None):
+            # make sure enums are the same order every time
+            try:
+                feature_info["enum"].sort(key=lambda x: (isinstance(x, str), x))
+            except Exception:
+                unsortable_values = [v for v in feature_info['enum'] if not isinstance(v, (str, int, float))]
+                LOGGER.warning(f'Could not encode the enum of {column}, unexpected values: {unsortable_values}')
+                raise KeyError(f'Unsortable enum values in {column}')
+            column_info = {
+                'name': column,
+                'enum': feature_info['enum'],
+                'range': len(feature_info['enum']),
+                'min': 0,
+                'max': len(feature_info['enum']) - 1,
+                'is_integer': False,
+                'categories': feature_info.get('categories', []),
+                'name_lookup': feature_info.get('name_lookup', []),
+            }
+        else:
+            # No enum, probably an integer and may have min and max
+            if feature_info.get('type', None) == 'integer':
+                if feature_info.get('minimum', None) and feature_info.get('maximum', None):
+                    bins = get_integer_bins(feature, feature_info)
+                    column_info = {
+                        'name': column,
+                        'enum': [],
+                        'range': len(bins) if bins else feature_info['maximum'] - feature_info['minimum'] + 1,
+                        'min': feature_info['minimum'],
+                        'max': feature_info['maximum'],
+                        'is_integer': True,
+                        'bins': bins,
+                        'categories': feature_info.get('categories', []),
+                        'name_lookup': feature_info.get('name_lookup', []),
+                    }
+                else:
+                    continue
+            else:
+                continue
+
+        data_column_info[column] = column_info
+
+    return data_column_info
+
+
+def get_integer_bins(feature, feature_info):
+    """Get the lower bound of each bin of an integer feature from its optional yaml bins, empty for one bin per value."""
+    bins = feature_info.get('bins', None) or []
+    if any(not isinstance(lower_bound, int) for lower_bound in bins) or bins != sorted(set(bins)):
+        raise ValueError(f'{feature} bins must be increasing integers, got {bins}')
+    if bins and (bins[0] < feature_info['minimum'] or bins[-1] > feature_info['maximum']):
+        raise ValueError(f"{feature} bins must be between its minimum {feature_info['minimum']} and maximum {feature_info['maximum']}")
+    return bins
+
+
+def get_code_dtype(n_levels):
+    """Get the smallest integer dtype that holds the codes of features with n_levels."""
+    max_levels = max(n_levels, default=0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_levels <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def get_enum_encoder(column_info):
+    """Get the exact match map and the > and < buckets of an enum feature."""
+    # all enums seem to be ints or strings
+    enum_equal_map = {v: i for i, v in enumerate(column_info["enum"]) if not (isinstance(v,str) and ('>' in v or '<' in v))}
+    enum_gt = None
+    enum_lt = None
+    for i, e in enumerate(column_info["enum"]):
+        if isinstance(e, str):
+            if '>' in e and enum_gt is None:
+                enum_gt = {
+                    "label": e,
+                    "gt": float(e.replace('>','')),
+                    "val": i,
+                }
+            elif '<' in e and enum_lt is None:
+                enum_lt = {
+                    "label": e,
+                    "lt": float(e.replace('<','')),
+                    "val": i,
+                }
+    return enum_equal_map, enum_gt, enum_lt
+
+
+def encode_enum_value(value, enum_equal_map, enum_gt, enum_lt):
+    """Get the code of an enum csv value, None if it is not in the enums."""
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None and number.is_integer():
+        # whole numbers match the enums without a decimal point
+        value = str(int(number))
+    if value in enum_equal_map:
+        return enum_equal_map[value]
+    if value == 'Missing':
+        return MISSING_CODE
+    if number is not None:
+        if enum_gt and number > enum_gt['gt']:
+            return enum_gt['val']
+        if enum_lt and number < enum_lt['lt']:
+            return enum_lt['val']
+    return None
+
+
+def encode_integer_value(value, column_info):
+    """Get the code of an integer csv value, None if it is not a number."""
+    if value == 'Missing':
+        return MISSING_CODE
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if not np.isfinite(number):
+        return MISSING_CODE
+    if not number.is_integer() or not column_info['min'] <= number <= column_info['max']:
+        return INVALID_CODE
+    if column_info.get('bins'):
+        # values below the first bin's lower bound are in no bin
+        code = bisect.bisect_right(column_info['bins'], int(number)) - 1
+        return code if code >= 0 else INVALID_CODE
+    return int(number) - column_info['min']
+
+
+def encode_rows(rows, data_columns, data_column_info):
+    """Encode csv rows into a matrix of feature codes.
+
+    Values are encoded once per unique value in each column. Returns the codes,
+    MISSING_CODE where empty and INVALID_CODE where out of an integer feature's range or bins,
+    and the count of every value that couldn't be encoded by column.
+    """
+    column_index = {column: i for i, column in enumerate(data_columns)}
+    n_levels = [column_info['range'] for column_info in data_column_info.values()]
+    codes = np.full((len(rows), len(data_column_info)), MISSING_CODE, dtype=get_code_dtype(n_levels))
+    unknown_values = {}
+    # transpose the rows into columns, short rows are missing their last values
+    data_values = list(itertools.zip_longest(*rows, fillvalue=''))
+    for i_col, (column, column_info) in enumerate(data_column_info.items()):
+        i_data = column_index[column]
+        if i_data >= len(data_values):
+            continue
+        unique_values, inverse, unique_counts = np.unique(
+            np.asarray(data_values[i_data], dtype=str),
+            return_inverse=True,
+            return_counts=True,
+        )
+        if not column_info['is_integer']:
+            enum_equal_map, enum_gt, enum_lt = get_enum_encoder(column_info)
+        unique_codes = np.full(len(unique_values), MISSING_CODE, dtype=codes.dtype)
+        for k, value in enumerate(unique_values):
+            if not value:
+                continue
+            if column_info['is_integer']:
+                code = encode_integer_value(value, column_info)
+            else:  # enum
+                code = encode_enum_value(value, enum_equal_map, enum_gt, enum_lt)
+            if code is None:
+                unknown_values.setdefault(column, {})[str(value)] = int(unique_counts[k])
+                code = MISSING_CODE if not column_info['is_integer'] else INVALID_CODE
+            unique_codes[k] = code
+        codes[:, i_col] = unique_codes[inverse.reshape(-1)]
+
+    return codes, unknown_values
@@ -1,34 +1,24 @@
 import numpy as np
 import logging
-import scipy.stats as scistats
 
-LOGGER = logging.getLogger(__name__)
-
-
-def get_feature_count_matrix(x1, x2, u_x1, u_x2, feature_1, feature_2):
-    # TODO: This won't handle cases where there are invalid values in the data
-    feat_count_mat = np.zeros((len(u_x2), len(u_x1)))
-
-    errors = False
-    for cx1, cx2 in zip(x1, x2):
-        if (not np.isnan(cx1)) and (not np.isnan(cx2)):
-            try:
-                i_x1 = np.where(u_x1 == cx1)[0][0]
-                i_x2 = np.where(u_x2 == cx2)[0][0]
+from utils.contingency import get_batched_chi_squared, get_batched_odds_ratio_stats
 
-                feat_count_mat[i_x2, i_x1] += 1  # x2 should be on the rows and x1 on the cols
-            except IndexError as e:
-                errors = True
-                pass
-    if errors:
-        LOGGER.warning(f"Computed count matrix with errors for {feature_1} and {feature_2}")
+LOGGER = logging.getLogger(__name__)
 
-    return feat_count_mat
+TRUTHY_FEATURES = [["False", "True"], ["false", "true"], ["Negative", "Positive"], ["0", "1"], ["no", "yes"]]
+# ["Ever", "Never"]
 
 
-def get_feature_info_from_column_info(column_info):
-    """Get feature qualifiers from column info."""
-    if column_info['is_integer']:
+def get_feature_info_from_column_info(column_info, levels=None):
+    """Get feature qualifiers from column info, only those of the bin codes in levels if given."""
+    if column_info.get('bins'):
+        # each bin runs from its lower bound up to the next one, the last up to the maximum
+        upper_bounds = [lower_bound - 1 for lower_bound in column_info['bins'][1:]] + [column_info['max']]
+        feature_qualifiers = [
+            {"operator": "between", "value_a": lower_bound, "value_b": upper_bound}
+            for lower_bound, upper_bound in zip(column_info['bins'], upper_bounds)
+        ]
+    elif column_info['is_integer']:
         feature_qualifiers = [
             {"operator": "=", "value": i + column_info['min']}
             for i in range(column_info['range'])
@@ -38,6 +28,8 @@ def get_feature_info_from_column_info(column_info):
             {"operator": "=", "value": k}
             for k in column_info['enum']
         ]
+    if levels is not None:
+        feature_qualifiers = [feature_qualifiers[level] for level in levels]
 
     return {
         'feature_name': column_info['name'],
@@ -73,16 +65,49 @@ def get_feature_matrix_json(count_mat):
     return matrix
 
 
-def get_edge_stats(x1, x2, u_x1, u_x2, i_column, j_column, i_column_info, j_column_info):
-    """Compute edge statistics from count matrix."""
+def has_odds_ratio(count_mat):
+    """Check if a count matrix is a 2x2 table with no zeroes, which gets Fisher and odds ratio stats."""
+    return count_mat.shape == (2, 2) and not np.any(count_mat == 0)
+
+
+def is_truthy_pair(i_column_info, j_column_info):
+    """Check if both features are True/False-like, so their edge can be signed."""
+    return i_column_info["enum"] in TRUTHY_FEATURES and j_column_info["enum"] in TRUTHY_FEATURES
+
+
+def get_odds_ratio_stats(count_mats, truthy):
+    """Compute the predicate and Fisher/odds ratio edge stats for many 2x2 count matrices at once.
+
+    Returns a list of (predicate, stats) with one entry per count matrix.
+    """
+    if not len(count_mats):
+        return []
+    batch = get_batched_odds_ratio_stats(np.stack(count_mats), truthy)
+    return [
+        (batch["predicate"][k], {
+            "fisher_exact_odds_ratio": batch["fisher_exact_odds_ratio"][k],
+            "fisher_exact_p": batch["fisher_exact_p"][k],
+            "log_odds_ratio": batch["log_odds_ratio"][k],
+            "log_odds_ratio_95_ci": batch["log_odds_ratio_95_ci"][k].tolist(),
+        })
+        for k in range(len(count_mats))
+    ]
+
+
+def get_edge_stats_from_count_matrix(count_mat, i_column_info, j_column_info, chi_squared=None, odds_ratio_stats=None):
+    """Compute edge statistics from count matrix.
+
+    chi_squared can be a precomputed (statistic, p, dof) tuple, e.g. from get_batched_chi_squared,
+    and odds_ratio_stats a precomputed (predicate, stats) tuple from get_odds_ratio_stats.
+    """
     predicate = "biolink:correlated_with"
 
-    count_mat = get_feature_count_matrix(x1, x2, u_x1, u_x2, i_column, j_column)
     # Currently we calculate the chi2 value and parameter
-    # We can do this for any size count_mat
+    # We can do this for any size count_mat, its empty rows and cols are left out
 
-    eps = np.finfo(np.float32).eps
-    chi_squared_statistic, chi_squared_p, chi_squared_dof, _ = scistats.chi2_contingency(count_mat + eps, correction=False)
+    if chi_squared is None:
+        chi_squared = get_batched_chi_squared([count_mat])[0]
+    chi_squared_statistic, chi_squared_p, chi_squared_dof = chi_squared
 
     # we are changing some variable names for clarity
     # chi_squared ---> chi_squared_statistic
@@ -96,53 +121,10 @@ def get_edge_stats(x1, x2, u_x1, u_x2, i_column, j_column, i_column_info, j_colu
     }
 
     # If we only have a 2x2 count_mat and there are no zeroes we can do other tests
-    if count_mat.shape == (2, 2) and not np.any(count_mat==0):
-
-        try:
-            # We could also do a fisher_exact test
-            # Technically the chi_squared is an approximate at smaller sample sizes
-            # At larger sample sizes this can be slow? apparently? I think it's fine though
-            fisher_exact_odds_ratio, fisher_exact_p = scistats.fisher_exact(count_mat, alternative='two-sided')
-
-            # For 2D count_mat we can also calculate the odds ratio with scipy
-            # But this seems to be missing from some versions of scipy
-            # oddsratio = scistats.contingency.odds_ratio(count_mat)
-            # The odds_ratio method also can give you confidence internal
-            # Which fisher_exact can't 
-
-            # We can just write our own quick version though
-            odds_r0 = count_mat[0][0]/count_mat[0][1]
-            odds_r1 = count_mat[1][0]/count_mat[1][1]
-
-            try:
-                odds_ratio = odds_r0/odds_r1 # This is the same as fisher
-                # https://www.bmj.com/content/bmj/320/7247/1468.1.full.pdf
-            except Exception as e:
-                LOGGER.error(f"Error comupting odds ratio: {e}")
-
-            log_odds_ratio = np.log(odds_ratio)
-
-            se_log_odds_ratio = np.sqrt(
-                1/(count_mat[0][0] + eps) + 1/(count_mat[0][1] + eps) + 1/(count_mat[1][0] + eps) + 1/(count_mat[1][1]  + eps)
-            )
-
-            log_odds_ratio_interval = [log_odds_ratio - 1.96*se_log_odds_ratio, log_odds_ratio + 1.96*se_log_odds_ratio]
-
-            truthy_features = [["False", "True"], ["false", "true"], ["Negative", "Positive"], ["0", "1"], ["no", "yes"]]
-            # ["Ever", "Never"]
-            if i_column_info["enum"] in truthy_features and j_column_info["enum"] in truthy_features:
-                if log_odds_ratio < -np.log(1.25):
-                    predicate = "biolink:negatively_correlated_with"
-                elif log_odds_ratio > np.log(1.25):
-                    predicate = "biolink:positively_correlated_with"
-
-            edge_stats.update({
-                "fisher_exact_odds_ratio": fisher_exact_odds_ratio,
-                "fisher_exact_p": fisher_exact_p,
-                "log_odds_ratio": log_odds_ratio,
-                "log_odds_ratio_95_ci": log_odds_ratio_interval,
-            })
-        except Exception as e:
-            LOGGER.error(f"Error computing edge stats: {e}")
+    if has_odds_ratio(count_mat):
+        if odds_ratio_stats is None:
+            odds_ratio_stats = get_odds_ratio_stats([count_mat], [is_truthy_pair(i_column_info, j_column_info)])[0]
+        predicate, fisher_stats = odds_ratio_stats
+        edge_stats.update(fisher_stats)
 
     return predicate, edge_stats
@@ -0,0 +1,128 @@
+import cProfile
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+from utils.atomic_write import atomic_write
+
+
+def get_peak_rss_mb(who='self'):
+    """Get the peak resident memory of this process, or of its largest finished child, in MB."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return usage.ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def get_cpu_seconds():
+    """Get the CPU time of this process and its finished children."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class RunReport:
+    """Wall time, CPU time and peak memory of named stages, and named counters.
+
+    peak_rss_mb is the process's peak memory when the stage ended, which later stages
+    repeat; peak_rss_delta_mb is how far the stage itself raised it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage, adding to earlier runs of the same stage."""
+        wall_start = time.perf_counter()
+        cpu_start = get_cpu_seconds()
+        peak_rss_start = get_peak_rss_mb()
+        children_peak_rss_start = get_peak_rss_mb('children')
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            stage['wall_seconds'] += time.perf_counter() - wall_start
+            stage['cpu_seconds'] += get_cpu_seconds() - cpu_start
+            stage['calls'] += 1
+            # the peaks are high-water marks of the whole process so far, the deltas how much this stage raised them
+            stage['peak_rss_mb'] = get_peak_rss_mb()
+            stage['children_peak_rss_mb'] = get_peak_rss_mb('children')
+            if peak_rss_start is not None:
+                stage['peak_rss_delta_mb'] = max(stage.get('peak_rss_delta_mb', 0.0), stage['peak_rss_mb'] - peak_rss_start)
+                stage['children_peak_rss_delta_mb'] = max(stage.get('children_peak_rss_delta_mb', 0.0), stage['children_peak_rss_mb'] - children_peak_rss_start)
+
+    def count(self, name, n=1):
+        """Add n to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def add_counters(self, counters):
+        """Add every counter of a dict."""
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def to_dict(self):
+        return {'stages': self.stages, 'counters': self.counters}
+
+
+def save_run_report(report_path, report):
+    """Atomically write a run report."""
+    with atomic_write(report_path) as f:
+        json.dump(report, f, indent=2)
+
+
+@contextmanager
+def profiled(profile_path):
+    """Profile the block with cProfile and dump the stats to profile_path, if it is set.
+
+    The stats can be read with pstats, snakeviz or similar.
+    """
+    if not profile_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+class RateLimitedProgress:
+    """Log progress through a known number of items at most every interval seconds."""
+
+    def __init__(self, logger, description, total, interval=30.0):
+        self.logger = logger
+        self.description = description
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_log = self.start
+
+    def update(self, n=1):
+        """Mark n more items done."""
+        self.done += n
+        now = time.perf_counter()
+        if now - self.last_log >= self.interval:
+            self.last_log = now
+            self.log(now)
+
+    def log(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        self.logger.info(f'{self.description}: {self.done} of {self.total} ({rate:.1f}/s)')
+
+    def close(self):
+        """Log the final count."""
+        self.log()
@@ -0,0 +1,75 @@
+"""Fast json lines encoding with orjson, falling back to json if it isn't installed."""
+from decimal import Decimal
+import json
+import math
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Parse a json document from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def format_float(value):
+    """Format a float or numpy float the way orjson does, null if it isn't finite.
+
+    orjson writes the shortest digits that round trip, as repr does for float64
+    and str for float32, but switches to an exponent at different lengths.
+    """
+    if not math.isfinite(value):
+        return 'null'
+    if value == 0:
+        return '-0.0' if math.copysign(1, value) < 0 else '0.0'
+    is_float32 = isinstance(value, np.float32)
+    sign, digits, exponent = Decimal(str(value) if is_float32 else repr(float(value))).normalize().as_tuple()
+    sign = '-' if sign else ''
+    digits = ''.join(map(str, digits))
+    # value is 0.digits * 10**point
+    point = len(digits) + exponent
+    min_point, max_point = (-6, 13) if is_float32 else (-5, 16)
+    if 0 <= exponent and point <= max_point:
+        return f"{sign}{digits}{'0' * exponent}.0"
+    if 0 < point <= max_point:
+        return f'{sign}{digits[:point]}.{digits[point:]}'
+    if min_point < point <= 0:
+        return f"{sign}0.{'0' * -point}{digits}"
+    if len(digits) == 1:
+        return f'{sign}{digits}e{point - 1}'
+    return f'{sign}{digits[0]}.{digits[1:]}e{point - 1}'
+
+
+def encode(value):
+    """Serialize to a compact json str the same way orjson does, with numpy values and nan and inf as null."""
+    if isinstance(value, np.ndarray):
+        return '[' + ','.join(encode(v) for v in value) + ']'
+    if isinstance(value, np.floating):
+        return format_float(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, bool):
+        return json.dumps(value)
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return format_float(value)
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{encode(str(k))}:{encode(v)}' for k, v in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(encode(v) for v in value) + ']'
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def dumps(value):
+    """Serialize to a compact json str, the same with or without orjson."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return encode(value)
@@ -0,0 +1,37 @@
+import hashlib
+import json
+import numpy as np
+
+from utils.atomic_write import atomic_write
+
+# Changes with the way pair stats are computed, so stats from older builds are recomputed
+PAIR_STATS_VERSION = 3
+
+
+def get_pair_key(csv_hash, i_column_hash, j_column_hash):
+    """Get the key of a feature pair's stats from the hashes of its inputs."""
+    return hashlib.sha256(f'{PAIR_STATS_VERSION}|{csv_hash}|{i_column_hash}|{j_column_hash}'.encode()).hexdigest()
+
+
+def to_json(value):
+    """Convert numpy values for json.dump."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def load_manifest(manifest_path):
+    """Load a cohort's build manifest, empty if there isn't one."""
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+    """Atomically write a cohort's build manifest."""
+    with atomic_write(manifest_path) as f:
+        json.dump(manifest, f, default=to_json)
@@ -1,54 +1,250 @@
+import aiohttp
+import asyncio
+from collections import Counter
+import copy
 from dotenv import load_dotenv
+import json
 import logging
-import requests
+from pathlib import Path
 import os
+import sqlite3
+import time
 
 load_dotenv()
 
 node_norm = os.getenv('NODE_NORM', 'https://nodenormalization-sri.renci.org/get_normalized_nodes')
 name_resolver = os.getenv('NAME_RESOLVER', 'https://name-resolution-sri.renci.org/lookup')
 
+# Persistent lookup cache, shared by every run and cohort
+cache_path = os.getenv('NODE_LOOKUP_CACHE', f"{Path(__file__).parent.parent.parent.resolve()}/cache/node_lookup.sqlite")
+# Seconds before a cached lookup is refetched, 0 keeps them forever
+cache_ttl = float(os.getenv('NODE_LOOKUP_CACHE_TTL', 30 * 24 * 60 * 60))
+# Never contact the services, only answer from the cache
+cache_only = os.getenv('NODE_LOOKUP_CACHE_ONLY', 'false').lower() in ('1', 'true', 'yes')
+# Max concurrent name resolver requests
+lookup_concurrency = int(os.getenv('NODE_LOOKUP_CONCURRENCY', 10))
+# Curies sent to node norm per request
+node_norm_batch_size = int(os.getenv('NODE_NORM_BATCH_SIZE', 1000))
+
 LOGGER = logging.getLogger(__name__)
 
+# Requests and cache hits of this process, for the run report
+lookup_counters = Counter()
 
-def node_lookup(search_term: str, limit: int) -> dict:
-    """Get normalized nodes from a search term."""
-    params = {'string': search_term, 'limit': limit}
-    try:
-        response = requests.post(name_resolver, params=params, data=None)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        LOGGER.warning(f'Failed to get identifiers for {search_term}')
-        return {}
-    response_json = response.json()
-    i_identifiers = [result["curie"] for result in response_json]
-    if not len(i_identifiers):
-        LOGGER.warning(f'No identifiers found for {search_term}')
-        return {}
-
-    body = {'curies': i_identifiers}
-    try:
-        response = requests.post(node_norm, json=body)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        LOGGER.warning(f"Failed to contact node normalizer for {search_term}")
-        return {}
 
+def get_service_name(endpoint):
+    """Get the name an endpoint's counters are reported under."""
+    return 'name_resolver' if endpoint == name_resolver else 'node_norm'
+
+
+class NodeLookupCache:
+    """SQLite backed cache of name resolver and node norm responses."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # sqlite connections can't be shared with forked processes
+        if self._connection is None or self._pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._pid = os.getpid()
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS lookups ('
+                'endpoint TEXT, key TEXT, value TEXT, created REAL, '
+                'PRIMARY KEY (endpoint, key))'
+            )
+            self.evict()
+        return self._connection
+
+    def evict(self):
+        """Remove expired entries."""
+        if self.ttl > 0:
+            with self._connection:
+                self._connection.execute('DELETE FROM lookups WHERE created < ?', (time.time() - self.ttl,))
+
+    def get_many(self, endpoint, keys):
+        """Get the cached values for keys, missing keys are left out."""
+        values = {}
+        keys = list(keys)
+        # stay below sqlite's bound parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT key, value, created FROM lookups WHERE endpoint = ? AND key IN ({','.join('?' * len(chunk))})",
+                [endpoint, *chunk],
+            )
+            for key, value, created in rows:
+                if self.ttl > 0 and created < time.time() - self.ttl:
+                    continue
+                values[key] = json.loads(value)
+        lookup_counters[f'{get_service_name(endpoint)}_cache_hits'] += len(values)
+        lookup_counters[f'{get_service_name(endpoint)}_cache_misses'] += len(keys) - len(values)
+        return values
+
+    def get(self, endpoint, key):
+        """Get a cached value or None."""
+        return self.get_many(endpoint, [key]).get(key)
+
+    def set_many(self, endpoint, values):
+        """Cache values by key."""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO lookups (endpoint, key, value, created) VALUES (?, ?, ?, ?)',
+                [(endpoint, key, json.dumps(value), now) for key, value in values.items()],
+            )
+
+    def set(self, endpoint, key, value):
+        """Cache a value."""
+        self.set_many(endpoint, {key: value})
+
+
+lookup_cache = NodeLookupCache(cache_path, cache_ttl)
+
+
+def get_search_key(search_term: str, limit: int) -> str:
+    """Get the cache key of a name resolver search."""
+    return json.dumps([search_term, limit])
+
+
+def get_nodes_from_normalized_identifiers(normalized_identifiers: dict) -> dict:
+    """Get nodes by preferred identifier from node norm results."""
     nodes = {}
-    try:
-        normalized_identifiers = response.json()
-        for node in normalized_identifiers.values():
-            if node is not None:
-                preferred_identifier = node["id"]["identifier"]
-                nodes[preferred_identifier] = {
-                    'name': node['id'].get('label', ''),
-                    'equivalent_identifiers': [eq_identifier['identifier'] for eq_identifier in node.get('equivalent_identifiers', [])],
-                    'categories': node.get('type', []),
-                }
-                if 'information_content' in node:
-                    nodes[preferred_identifier]['information_content'] = node['information_content']
-    except Exception as e:
-        LOGGER.error(f"Failed to parse node norm response: {e}")
-        return {}
+    for node in normalized_identifiers.values():
+        if node is not None:
+            preferred_identifier = node["id"]["identifier"]
+            nodes[preferred_identifier] = {
+                'name': node['id'].get('label', ''),
+                'equivalent_identifiers': [eq_identifier['identifier'] for eq_identifier in node.get('equivalent_identifiers', [])],
+                'categories': node.get('type', []),
+            }
+            if 'information_content' in node:
+                nodes[preferred_identifier]['information_content'] = node['information_content']
+    return nodes
 
+
+def get_feature_searches(features: dict) -> list:
+    """Get the unique (search_term, limit) pairs from the features yaml."""
+    searches = {}
+    for feature_info in features.values():
+        for node_search in feature_info.get('name_lookup', []):
+            searches[(node_search['search_term'], node_search['limit'])] = True
+    return list(searches)
+
+
+async def fetch_identifiers(session, semaphore, search_term: str, limit: int):
+    """Get curies from the name resolver, None if the lookup failed."""
+    params = {'string': search_term, 'limit': limit}
+    async with semaphore:
+        lookup_counters['name_resolver_requests'] += 1
+        try:
+            async with session.post(name_resolver, params=params) as response:
+                response.raise_for_status()
+                response_json = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            lookup_counters['name_resolver_errors'] += 1
+            LOGGER.warning(f'Failed to get identifiers for {search_term}')
+            return None
+    return [result["curie"] for result in response_json]
+
+
+async def fetch_normalized_identifiers(session, semaphore, curies: list):
+    """Get node norm results by curie, None if the lookup failed."""
+    body = {'curies': curies}
+    async with semaphore:
+        lookup_counters['node_norm_requests'] += 1
+        try:
+            async with session.post(node_norm, json=body) as response:
+                response.raise_for_status()
+                response_json = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            lookup_counters['node_norm_errors'] += 1
+            LOGGER.warning(f"Failed to contact node normalizer for {len(curies)} curies")
+            return None
+    return {curie: response_json.get(curie) for curie in curies}
+
+
+async def resolve_searches(searches: list) -> dict:
+    """Get normalized nodes for many searches with batched, concurrent requests.
+
+    Returns nodes by search key, see get_search_key.
+    """
+    search_keys = [get_search_key(search_term, limit) for search_term, limit in searches]
+    identifiers = lookup_cache.get_many(name_resolver, search_keys)
+    missing_searches = [search for search, search_key in zip(searches, search_keys) if search_key not in identifiers]
+    if missing_searches and cache_only:
+        for search_term, _ in missing_searches:
+            LOGGER.warning(f'No cached identifiers for {search_term}')
+        missing_searches = []
+
+    semaphore = asyncio.Semaphore(lookup_concurrency)
+    connector = aiohttp.TCPConnector(limit=lookup_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if missing_searches:
+            LOGGER.info(f'Resolving {len(missing_searches)} search terms')
+            results = await asyncio.gather(*[
+                fetch_identifiers(session, semaphore, search_term, limit)
+                for search_term, limit in missing_searches
+            ])
+            new_identifiers = {
+                get_search_key(search_term, limit): result
+                for (search_term, limit), result in zip(missing_searches, results)
+                if result is not None
+            }
+            lookup_cache.set_many(name_resolver, new_identifiers)
+            identifiers.update(new_identifiers)
+
+        all_curies = list(dict.fromkeys(curie for curies in identifiers.values() for curie in curies))
+        normalized_identifiers = lookup_cache.get_many(node_norm, all_curies)
+        missing_curies = [curie for curie in all_curies if curie not in normalized_identifiers]
+        if missing_curies and not cache_only:
+            LOGGER.info(f'Normalizing {len(missing_curies)} curies')
+            results = await asyncio.gather(*[
+                fetch_normalized_identifiers(session, semaphore, missing_curies[start:start + node_norm_batch_size])
+                for start in range(0, len(missing_curies), node_norm_batch_size)
+            ])
+            for result in results:
+                if result is not None:
+                    lookup_cache.set_many(node_norm, result)
+                    normalized_identifiers.update(result)
+
+    resolved = {}
+    for (search_term, _), search_key in zip(searches, search_keys):
+        if search_key not in identifiers:
+            resolved[search_key] = {}
+            continue
+        i_identifiers = identifiers[search_key]
+        if not len(i_identifiers):
+            LOGGER.warning(f'No identifiers found for {search_term}')
+            resolved[search_key] = {}
+            continue
+        if any(curie not in normalized_identifiers for curie in i_identifiers):
+            LOGGER.warning(f"Failed to normalize identifiers for {search_term}")
+            resolved[search_key] = {}
+            continue
+        try:
+            resolved[search_key] = get_nodes_from_normalized_identifiers(
+                {curie: normalized_identifiers[curie] for curie in i_identifiers}
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to parse node norm response: {e}")
+            resolved[search_key] = {}
+    return resolved
+
+
+def resolve_features(features: dict) -> dict:
+    """Get normalized nodes for every name lookup in the features yaml."""
+    return asyncio.run(resolve_searches(get_feature_searches(features)))
+
+
+def get_column_nodes(column_info: dict, resolved: dict) -> dict:
+    """Get a column's normalized nodes from resolve_features results."""
+    nodes = {}
+    for node_search in column_info['name_lookup']:
+        nodes.update(copy.deepcopy(resolved.get(get_search_key(node_search['search_term'], node_search['limit']), {})))
     return nodes
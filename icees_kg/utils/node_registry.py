@@ -0,0 +1,32 @@
+class NodeRegistry:
+    """The nodes of a cohort's features, with the categories added to them and whether they are on an edge."""
+
+    def __init__(self):
+        self.nodes = {}
+        # hard coded categories from the features yaml, by curie
+        self.added_categories = {}
+        self.connected = set()
+
+    def add_feature_nodes(self, feature_nodes, feature_categories=None):
+        """Register the nodes of a feature and the feature's categories."""
+        for curie, node in feature_nodes.items():
+            self.nodes.setdefault(curie, node)
+            if "categories" in node and feature_categories:
+                self.added_categories.setdefault(curie, set()).update(feature_categories)
+
+    def connect(self, curies):
+        """Mark curies as being on an edge."""
+        self.connected.update(curies)
+
+    def get_categories(self, curie):
+        """Get the categories of a node, sorted if any were added from the features yaml."""
+        categories = self.nodes[curie].get('categories', [])
+        if curie in self.added_categories:
+            return sorted(self.added_categories[curie].union(categories))
+        return categories
+
+    def iter_connected_nodes(self):
+        """Get the curie, node and categories of every node on an edge, in the order they were registered."""
+        for curie, node in self.nodes.items():
+            if curie in self.connected:
+                yield curie, node, self.get_categories(curie)
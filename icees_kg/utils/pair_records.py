@@ -0,0 +1,44 @@
+import json
+
+from utils.atomic_write import atomic_write
+from utils.compression import get_uncompressed_path
+
+
+def get_pairs_path(data_id, build_dir='../build'):
+    """Get the build file of a cohort's feature pair records."""
+    return f'{build_dir}/{data_id}_pairs.jsonl'
+
+
+def get_curies_path(pairs_path):
+    """Get the feature curies file that goes with a pair records file, compressed or not."""
+    return f"{get_uncompressed_path(pairs_path)[:-len('_pairs.jsonl')]}_curies.json"
+
+
+def get_pair_record(subject_column, object_column, predicate, edge_props):
+    """Get the build record of a feature pair, which stands for an edge between each of their curies."""
+    return {
+        'subject_column': subject_column,
+        'object_column': object_column,
+        'predicate': predicate,
+        'biolink:primary_knowledge_source': 'infores:icees-kg',
+        **edge_props,
+    }
+
+
+def save_feature_curies(curies_path, feature_curies):
+    """Atomically write the curies of each feature of a cohort."""
+    with atomic_write(curies_path) as f:
+        json.dump(feature_curies, f)
+
+
+def load_feature_curies(curies_path):
+    """Load the curies of each feature of a cohort."""
+    with open(curies_path, 'r') as f:
+        return json.load(f)
+
+
+def iter_pair_edges(record, feature_curies):
+    """Get the (subject, object) curies of every edge a pair record stands for."""
+    for subject_id in feature_curies[record['subject_column']]:
+        for object_id in feature_curies[record['object_column']]:
+            yield subject_id, object_id
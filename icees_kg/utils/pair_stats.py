@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import numpy as np
+import os
+import tempfile
+
+from utils.contingency import get_pair_count_matrix, get_batched_chi_squared
+from utils.get_features import get_edge_stats_from_count_matrix, get_odds_ratio_stats, has_odds_ratio, is_truthy_pair
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_pair_shards(pairs, n_shards):
+    """Split pairs into n_shards contiguous shards, keeping their order."""
+    n_shards = max(1, min(n_shards, len(pairs)))
+    bounds = np.linspace(0, len(pairs), n_shards + 1).astype(int)
+    return [pairs[bounds[k]:bounds[k + 1]] for k in range(n_shards)]
+
+
+def compute_pair_stats(pair_counts, level_offsets, code_index, pairs, column_infos):
+    """Compute edge stats for pairs of columns from the pair count matrix.
+
+    Returns a list with (predicate, edge_stats) for each pair, or the error message
+    if the stats couldn't be computed.
+    """
+    count_mats = [
+        get_pair_count_matrix(pair_counts, level_offsets, code_index[i_col], code_index[j_col])
+        for i_col, j_col in pairs
+    ]
+    chi_squared = get_batched_chi_squared(count_mats)
+    two_by_two = [k for k, count_mat in enumerate(count_mats) if has_odds_ratio(count_mat)]
+    odds_ratio_stats = [None] * len(pairs)
+    for k, stats in zip(two_by_two, get_odds_ratio_stats(
+        [count_mats[k] for k in two_by_two],
+        [is_truthy_pair(column_infos[pairs[k][0]], column_infos[pairs[k][1]]) for k in two_by_two],
+    )):
+        odds_ratio_stats[k] = stats
+    results = []
+    for (i_col, j_col), count_mat, pair_chi_squared, pair_odds_ratio_stats in zip(pairs, count_mats, chi_squared, odds_ratio_stats):
+        try:
+            results.append(get_edge_stats_from_count_matrix(
+                count_mat,
+                column_infos[i_col],
+                column_infos[j_col],
+                chi_squared=pair_chi_squared,
+                odds_ratio_stats=pair_odds_ratio_stats,
+            ))
+        except Exception as e:
+            results.append(str(e))
+    return results
+
+
+def compute_pair_stats_shard(counts_path, level_offsets, code_index, pairs, column_infos):
+    """Compute edge stats for a shard of pairs from a memory-mapped pair count matrix."""
+    pair_counts = np.load(counts_path, mmap_mode='r')
+    return compute_pair_stats(pair_counts, level_offsets, code_index, pairs, column_infos)
+
+
+def compute_all_pair_stats(pair_counts, level_offsets, code_index, pairs, column_infos, workers=1):
+    """Compute edge stats for every pair, sharded over worker processes.
+
+    The pair count matrix is shared with the workers through a memory-mapped file
+    and results come back in the same order as pairs.
+    """
+    if workers <= 1 or len(pairs) < 2:
+        return compute_pair_stats(pair_counts, level_offsets, code_index, pairs, column_infos)
+
+    shards = get_pair_shards(pairs, workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        counts_path = os.path.join(tmp_dir, 'pair_counts.npy')
+        np.save(counts_path, pair_counts)
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            shard_results = executor.map(
+                compute_pair_stats_shard,
+                [counts_path] * len(shards),
+                [level_offsets] * len(shards),
+                [code_index] * len(shards),
+                shards,
+                [column_infos] * len(shards),
+            )
+            return [result for shard_result in shard_results for result in shard_result]
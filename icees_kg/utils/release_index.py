@@ -0,0 +1,127 @@
+"""SQLite index of a release's edges and nodes, by curie, predicate and category.
+
+The index keeps the byte offset and length of every line in the uncompressed
+jsonl, so whole edges and nodes can be read back without scanning the release.
+"""
+import os
+import sqlite3
+
+from utils.atomic_write import atomic_path
+from utils.compression import open_input
+from utils.json_codec import loads
+
+INDEX_BATCH_SIZE = 10000
+
+
+def iter_line_offsets(path):
+    """Get every line of a jsonl file, compressed or not, with its offset and length in the uncompressed file."""
+    offset = 0
+    with open_input(path) as f:
+        for raw_line in f:
+            if raw_line.strip():
+                yield loads(raw_line), offset, len(raw_line)
+            offset += len(raw_line)
+
+
+def insert_batches(connection, sql, rows):
+    """Insert rows in batches."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INDEX_BATCH_SIZE:
+            connection.executemany(sql, batch)
+            batch = []
+    connection.executemany(sql, batch)
+
+
+def build_release_index(release_path, edges_file, nodes_file, index_path):
+    """Index the edges and nodes files of a release folder into a new sqlite file at index_path."""
+    with atomic_path(index_path) as tmp_path:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            # nothing to recover if the build fails half way, it's just started again
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE files (kind TEXT PRIMARY KEY, name TEXT)')
+            connection.execute('CREATE TABLE edges (subject TEXT, predicate TEXT, object TEXT, offset INTEGER, length INTEGER)')
+            connection.execute('CREATE TABLE nodes (id TEXT PRIMARY KEY, offset INTEGER, length INTEGER) WITHOUT ROWID')
+            connection.execute('CREATE TABLE node_categories (id TEXT, category TEXT, PRIMARY KEY (id, category)) WITHOUT ROWID')
+            connection.executemany('INSERT INTO files (kind, name) VALUES (?, ?)', [('edges', edges_file), ('nodes', nodes_file)])
+
+            insert_batches(connection, 'INSERT INTO edges (subject, predicate, object, offset, length) VALUES (?, ?, ?, ?, ?)', (
+                (line['subject'], line['predicate'], line['object'], offset, length)
+                for line, offset, length in iter_line_offsets(os.path.join(release_path, edges_file))
+            ))
+            node_lines = list(iter_line_offsets(os.path.join(release_path, nodes_file)))
+            insert_batches(connection, 'INSERT OR IGNORE INTO nodes (id, offset, length) VALUES (?, ?, ?)', (
+                (line['id'], offset, length) for line, offset, length in node_lines
+            ))
+            insert_batches(connection, 'INSERT OR IGNORE INTO node_categories (id, category) VALUES (?, ?)', (
+                (line['id'], category) for line, _, _ in node_lines for category in line.get('category', [])
+            ))
+
+            # indexes are faster to build once the rows are in
+            connection.execute('CREATE INDEX edges_subject ON edges (subject, predicate)')
+            connection.execute('CREATE INDEX edges_object ON edges (object, predicate)')
+            connection.execute('CREATE INDEX edges_predicate ON edges (predicate)')
+            connection.execute('CREATE INDEX node_categories_category ON node_categories (category)')
+            connection.commit()
+        finally:
+            connection.close()
+
+
+class ReleaseIndex:
+    """Read only lookups of the edges and nodes of a release from its index."""
+
+    def __init__(self, index_path, release_path=None):
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f'No release index at {index_path}, run massage.py with --index')
+        self.release_path = release_path or os.path.dirname(index_path)
+        self.connection = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True)
+        self.files = dict(self.connection.execute('SELECT kind, name FROM files'))
+
+    def find_edges(self, subject_id=None, predicate=None, object_id=None, subject_category=None, object_category=None):
+        """Get the (subject, predicate, object, offset, length) of every edge matching all of the given fields."""
+        conditions = []
+        parameters = []
+        for column, value in [('subject', subject_id), ('predicate', predicate), ('object', object_id)]:
+            if value is not None:
+                conditions.append(f'edges.{column} = ?')
+                parameters.append(value)
+        for column, category in [('subject', subject_category), ('object', object_category)]:
+            if category is not None:
+                conditions.append(f'edges.{column} IN (SELECT id FROM node_categories WHERE category = ?)')
+                parameters.append(category)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self.connection.execute(
+            f'SELECT subject, predicate, object, offset, length FROM edges {where} ORDER BY offset',
+            parameters,
+        ).fetchall()
+
+    def get_node_categories(self, curie):
+        """Get the categories of a node, empty if it isn't in the release."""
+        return [category for category, in self.connection.execute('SELECT category FROM node_categories WHERE id = ?', (curie,))]
+
+    def read_lines(self, kind, offsets):
+        """Get the parsed lines of the edges or nodes file at (offset, length) pairs.
+
+        Uncompressed files are read with seeks, compressed ones are streamed up to the last line.
+        """
+        path = os.path.join(self.release_path, self.files[kind])
+        offsets = sorted(set(offsets))
+        lines = []
+        with open_input(path) as f:
+            position = 0
+            for offset, length in offsets:
+                if f.seekable():
+                    f.seek(offset)
+                else:
+                    # decompressing streams can only skip forward
+                    while position < offset:
+                        skipped = len(f.read(min(offset - position, 1 << 20)))
+                        if not skipped:
+                            raise EOFError(f'{path} is shorter than its index, rebuild the index')
+                        position += skipped
+                lines.append(loads(f.read(length)))
+                position = offset + length
+        return lines
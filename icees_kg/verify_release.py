@@ -0,0 +1,86 @@
+import argparse
+import json
+import sys
+import time
+
+from massage import release_version
+from utils.release_index import ReleaseIndex
+
+
+# Predicates of edges that hold both ways, main.py only writes them one way round
+SYMMETRIC_PREDICATES = {
+    'biolink:correlated_with',
+    'biolink:positively_correlated_with',
+    'biolink:negatively_correlated_with',
+}
+EDGE_MISSING = 'edge missing'
+DIFFERENT_PREDICATE = 'edge present with a different predicate'
+
+
+def get_edge_predicates(release_index, subject, object_id):
+    """Get the predicates of the release edges from subject to object, or from object to subject for symmetric ones."""
+    predicates = {predicate for _, predicate, *_ in release_index.find_edges(subject_id=subject, object_id=object_id)}
+    predicates.update(
+        predicate for _, predicate, *_ in release_index.find_edges(subject_id=object_id, object_id=subject)
+        if predicate in SYMMETRIC_PREDICATES
+    )
+    return predicates
+
+
+def check_test_edge(release_index, test_edge):
+    """Get why an SRI test edge isn't in the release, None if it is."""
+    predicates = get_edge_predicates(release_index, test_edge['subject'], test_edge['object'])
+    if test_edge['predicate'] not in predicates:
+        if predicates:
+            return f"{DIFFERENT_PREDICATE} ({', '.join(sorted(predicates))})"
+        return EDGE_MISSING
+    for end in ['subject', 'object']:
+        category = test_edge.get(f'{end}_category')
+        if category and category not in release_index.get_node_categories(test_edge[end]):
+            return f"{end} {test_edge[end]} isn't a {category}"
+    return None
+
+
+def verify_test_data(release_index, test_data_path):
+    """Check every edge of an SRI test data file against the release, returning the failures."""
+    with open(test_data_path, 'r') as f:
+        test_edges = json.load(f)['edges']
+    failures = []
+    for test_edge in test_edges:
+        reason = check_test_edge(release_index, test_edge)
+        if reason is not None:
+            failures.append((test_edge, reason))
+    return test_edges, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a release against SRI test data, or look up edges, with its index.')
+    parser.add_argument('--release', default=f'releases/{release_version}', help='Release folder with an index.sqlite from massage.py --index.')
+    parser.add_argument('--test-data', default='tests/sri_test_data.json', help='SRI test data whose edges should all be in the release.')
+    parser.add_argument('--curie', default=None, help='Print the edges of this curie instead.')
+    args = parser.parse_args()
+
+    release_index = ReleaseIndex(f'{args.release}/index.sqlite')
+
+    if args.curie:
+        rows = release_index.find_edges(subject_id=args.curie) + release_index.find_edges(object_id=args.curie)
+        for edge in release_index.read_lines('edges', [(offset, length) for *_, offset, length in rows]):
+            print(json.dumps(edge))
+        return
+
+    start = time.perf_counter()
+    test_edges, failures = verify_test_data(release_index, args.test_data)
+    milliseconds = (time.perf_counter() - start) * 1000
+    for test_edge, reason in failures:
+        print(f"Missing {test_edge['subject']} {test_edge['predicate']} {test_edge['object']}: {reason}")
+    n_different_predicate = sum(reason.startswith(DIFFERENT_PREDICATE) for _, reason in failures)
+    print(
+        f'{len(test_edges) - len(failures)} of {len(test_edges)} test edges found, '
+        f'{n_different_predicate} more with a different predicate, in {milliseconds:.1f} ms'
+    )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
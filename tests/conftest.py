@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the icees_kg scripts import their utils as a top level package
+sys.path.insert(0, str(Path(__file__).parent.parent / 'icees_kg'))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from utils.atomic_write import atomic_path, atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'file.json'
+    path.write_text('old')
+    with pytest.raises(ValueError):
+        with atomic_write(path) as f:
+            f.write('partial')
+            raise ValueError
+    # a failed write keeps the old file and leaves nothing behind
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['file.json']
+
+    with atomic_write(path) as f:
+        f.write('new')
+    assert path.read_text() == 'new'
+    assert os.listdir(tmp_path) == ['file.json']
+
+
+def test_atomic_path_folder(tmp_path):
+    path = tmp_path / 'tables'
+    path.mkdir()
+    (path / 'stale.npy').write_text('stale')
+    with atomic_path(path) as tmp_folder:
+        os.mkdir(tmp_folder)
+        with open(os.path.join(tmp_folder, 'index.json'), 'w') as f:
+            f.write('{}')
+    assert os.listdir(path) == ['index.json']
+    assert os.listdir(tmp_path) == ['tables']
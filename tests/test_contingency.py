@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+import scipy.stats as scistats
+
+from utils.contingency import (
+    drop_empty_margins, get_all_pair_counts, get_batched_chi_squared, get_batched_fisher_exact, get_batched_odds_ratio_stats,
+    get_level_codes, get_level_offsets, get_observed_levels, get_pair_count_matrix, reindex_pair_counts,
+)
+from utils.encoding import INVALID_CODE, MISSING_CODE
+
+RTOL = 1e-9
+
+
+def get_2x2_tables():
+    """Get random 2x2 tables of small and large counts, and the edge cases."""
+    rng = np.random.default_rng(0)
+    return np.concatenate([
+        rng.integers(0, 30, (1000, 2, 2)),
+        rng.integers(0, 3, (300, 2, 2)),
+        rng.integers(0, 200000, (200, 2, 2)),
+        np.array([
+            # zero cells
+            [[0, 5], [3, 4]],
+            [[5, 0], [0, 5]],
+            [[0, 7], [3, 0]],
+            # zero margins
+            [[0, 0], [3, 4]],
+            [[0, 5], [0, 4]],
+            [[0, 0], [0, 0]],
+            # large N
+            [[100000, 100200], [99800, 100000]],
+            [[1, 500000], [2, 600000]],
+            [[250000, 1], [1, 250000]],
+        ]),
+    ])
+
+
+def assert_close(actual, expected):
+    """Check values against scipy to RTOL, with nan and inf where scipy has them."""
+    np.testing.assert_allclose(actual, expected, rtol=RTOL, atol=0, equal_nan=True)
+
+
+@pytest.fixture(scope='module')
+def scipy_fisher_exact():
+    tables = get_2x2_tables()
+    results = [scistats.fisher_exact(table, alternative='two-sided') for table in tables]
+    return tables, np.array([result[0] for result in results]), np.array([result[1] for result in results])
+
+
+def test_batched_fisher_exact(scipy_fisher_exact):
+    tables, odds_ratios, p_values = scipy_fisher_exact
+    batched_odds_ratios, batched_p_values = get_batched_fisher_exact(tables)
+    assert_close(batched_odds_ratios, odds_ratios)
+    assert_close(batched_p_values, p_values)
+
+
+def test_batched_odds_ratio_stats(scipy_fisher_exact):
+    tables, odds_ratios, p_values = scipy_fisher_exact
+    # odds ratio stats are only computed for tables without zeros
+    no_zeros = np.all(tables > 0, axis=(1, 2))
+    stats = get_batched_odds_ratio_stats(tables[no_zeros], np.ones(np.sum(no_zeros), dtype=bool))
+    assert_close(stats['fisher_exact_odds_ratio'], odds_ratios[no_zeros])
+    assert_close(stats['fisher_exact_p'], p_values[no_zeros])
+    assert_close(np.exp(stats['log_odds_ratio']), odds_ratios[no_zeros])
+
+
+@pytest.fixture(scope='module')
+def pair_counts():
+    """Get random codes with missing and invalid values and a level that never occurs, and their pair counts."""
+    rng = np.random.default_rng(1)
+    n_levels = [2, 3, 4, 6]
+    codes = np.stack([rng.integers(0, n, 500) for n in n_levels], axis=1)
+    # level 2 of the third feature never occurs
+    codes[codes[:, 2] == 2, 2] = 3
+    codes[rng.random(codes.shape) < 0.15] = MISSING_CODE
+    codes[rng.random(codes.shape) < 0.05] = INVALID_CODE
+    counts, invalid_present = get_all_pair_counts(codes, n_levels, block_size=64)
+    return codes, n_levels, counts, invalid_present
+
+
+def get_crosstab(codes, n_levels, i_col, j_col):
+    """Count the rows of each pair of levels one row at a time, j on the rows and i on the cols."""
+    crosstab = np.zeros((n_levels[j_col], n_levels[i_col]))
+    for row in codes:
+        if row[i_col] >= 0 and row[j_col] >= 0:
+            crosstab[row[j_col], row[i_col]] += 1
+    return crosstab
+
+
+def test_pair_counts(pair_counts):
+    codes, n_levels, counts, invalid_present = pair_counts
+    offsets = get_level_offsets(n_levels)
+    for i_col in range(len(n_levels)):
+        for j_col in range(len(n_levels)):
+            np.testing.assert_array_equal(get_pair_count_matrix(counts, offsets, i_col, j_col), get_crosstab(codes, n_levels, i_col, j_col))
+            invalid = (codes[:, i_col] == INVALID_CODE) & (codes[:, j_col] != MISSING_CODE)
+            assert invalid_present[i_col, j_col] == np.sum(invalid)
+
+
+def test_batched_chi_squared(pair_counts):
+    codes, n_levels, counts, _ = pair_counts
+    offsets = get_level_offsets(n_levels)
+    count_mats = [
+        get_pair_count_matrix(counts, offsets, i_col, j_col)
+        for i_col in range(len(n_levels)) for j_col in range(len(n_levels)) if i_col < j_col
+    ]
+    # a table with a single observed row has no dof
+    count_mats.append(np.array([[0, 0, 0], [3, 0, 5]]))
+    for count_mat, (statistic, p, dof) in zip(count_mats, get_batched_chi_squared(count_mats)):
+        expected = scistats.chi2_contingency(drop_empty_margins(count_mat), correction=False)
+        # the batched test adds float32 eps to every cell, like the per-pair test it replaced
+        np.testing.assert_allclose([statistic, p], [expected[0], expected[1]], rtol=1e-6)
+        assert dof == expected[2]
+
+
+def get_codes(n_rows, n_levels, rng):
+    """Get random bin codes, with missing and invalid codes, that only use some levels of wide features."""
+    codes = np.stack([
+        rng.choice(np.arange(0, n, 1 + n // 10), n_rows) if n > 10 else rng.integers(0, n, n_rows)
+        for n in n_levels
+    ], axis=1)
+    codes[rng.random(codes.shape) < 0.1] = -1
+    codes[rng.random(codes.shape) < 0.02] = -2
+    return codes
+
+
+def test_observed_level_counts():
+    rng = np.random.default_rng(0)
+    n_levels = [2, 3, 500, 90]
+    codes = get_codes(2000, n_levels, rng)
+    # a value that only occurs in the last chunk
+    codes[1500:1510, 3] = 89
+    dense_counts, dense_invalid_present = get_all_pair_counts(codes, n_levels, block_size=300)
+
+    # levels first seen in later chunks are added as they come
+    column_levels = [np.arange(2), np.arange(3), np.arange(0), np.arange(0)]
+    counts = np.zeros((5, 5))
+    invalid_present = np.zeros((4, 4))
+    for start in range(0, len(codes), 700):
+        chunk = codes[start:start + 700]
+        observed_levels = get_observed_levels(chunk, column_levels)
+        counts = reindex_pair_counts(counts, column_levels, observed_levels)
+        column_levels = observed_levels
+        chunk_counts, chunk_invalid_present = get_all_pair_counts(get_level_codes(chunk, column_levels), [len(levels) for levels in column_levels], block_size=300)
+        counts += chunk_counts
+        invalid_present += chunk_invalid_present
+
+    for levels, n, column in zip(column_levels, n_levels, codes.T):
+        np.testing.assert_array_equal(levels, np.unique(column[column >= 0]) if n > 3 else np.arange(n))
+    offsets = get_level_offsets(n_levels)
+    levels = np.concatenate([offsets[k] + column_levels[k] for k in range(len(n_levels))])
+    assert counts.shape == (len(levels), len(levels))
+    np.testing.assert_array_equal(counts, dense_counts[np.ix_(levels, levels)])
+    np.testing.assert_array_equal(invalid_present, dense_invalid_present)
+    # the levels left out were never counted
+    assert np.sum(dense_counts) == np.sum(counts)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from utils.contingency import get_all_pair_counts, get_level_codes, get_level_offsets
+from utils.count_tables import get_aligned_count_tables, load_count_tables, save_count_tables
+
+COLUMNS = ['Sex', 'Age', 'Weight']
+N_LEVELS = [2, 90, 300]
+
+
+def save_cohort(path, codes):
+    """Save the count tables of encoded rows over their observed levels, returning the dense counts."""
+    column_levels = [np.arange(2)] + [np.unique(column[column >= 0]) for column in codes.T[1:]]
+    pair_counts, invalid_present = get_all_pair_counts(get_level_codes(codes, column_levels), [len(levels) for levels in column_levels])
+    column_infos = [{'name': column, 'range': n} for column, n in zip(COLUMNS, N_LEVELS)]
+    save_count_tables(path, 'csv_hash', COLUMNS, ['hash'] * len(COLUMNS), column_infos, column_levels, np.sum(codes >= 0, axis=0), pair_counts, invalid_present)
+    return get_all_pair_counts(codes, N_LEVELS)[0]
+
+
+def test_aligned_count_tables(tmp_path):
+    rng = np.random.default_rng(0)
+
+    def get_column(low, high, n_rows):
+        # every value from low to high occurs
+        return rng.permutation(np.resize(np.arange(low, high), n_rows))
+
+    cohort_codes = [
+        np.stack([get_column(0, 2, 500), get_column(0, 40, 500), get_column(100, 110, 500)], axis=1),
+        np.stack([get_column(0, 2, 300), get_column(30, 90, 300), get_column(200, 205, 300)], axis=1),
+    ]
+    dense_counts = [save_cohort(tmp_path / str(k), codes) for k, codes in enumerate(cohort_codes)]
+
+    tables = [load_count_tables(tmp_path / str(k)) for k in range(len(cohort_codes))]
+    assert tables[0]['pair_counts'].shape == (2 + 40 + 10, 2 + 40 + 10)
+    assert list(tables[1]['n_levels']) == [2, 60, 5]
+
+    # columns in another order than they were saved in
+    columns = ['Weight', 'Sex', 'Age']
+    pair_counts, _, n_values, column_levels = get_aligned_count_tables(tables, columns)
+    np.testing.assert_array_equal(column_levels[0], np.concatenate([np.arange(100, 110), np.arange(200, 205)]))
+    np.testing.assert_array_equal(column_levels[2], np.arange(90))
+    np.testing.assert_array_equal(n_values, [[500, 500, 500], [300, 300, 300]])
+
+    offsets = get_level_offsets(N_LEVELS)
+    k_columns = [COLUMNS.index(column) for column in columns]
+    levels = np.concatenate([offsets[k] + column_levels[i] for i, k in enumerate(k_columns)])
+    for cohort_pair_counts, cohort_dense_counts in zip(pair_counts, dense_counts):
+        np.testing.assert_array_equal(cohort_pair_counts, cohort_dense_counts[np.ix_(levels, levels)])
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+import pytest
+
+from utils import json_codec
+from utils.json_codec import encode
+
+
+def get_values():
+    """Get a record with every kind of value the build writes, and some awkward floats."""
+    rng = np.random.default_rng(0)
+    floats = rng.standard_normal(2000) * 10.0 ** rng.uniform(-30, 30, 2000)
+    return {
+        'floats': [float(v) for v in floats] + [1.5 * 10.0 ** k for k in range(-25, 25)] + [0.0, -0.0, 5e-324, 1e16, 1e-5],
+        'numpy_floats': [np.float64(v) for v in floats[:100]],
+        'float32': floats.astype(np.float32),
+        'not_finite': [float('nan'), float('inf'), -float('inf'), np.float64('nan'), np.array([np.inf, 1.0])],
+        'ints': [0, -3, 10 ** 18, np.int64(7), np.int8(-2), np.arange(3)],
+        'other': [True, False, None, np.bool_(True), (1, 2), {}, []],
+        'text': 'é✓ "quoted" \\ / \n\t' + ''.join(chr(c) for c in range(0x20)),
+        'nested': {'a': {'b': [np.array([[0.1, 2.0]]), 'c']}},
+    }
+
+
+def test_fallback_matches_orjson():
+    orjson = pytest.importorskip('orjson')
+    values = get_values()
+    assert encode(values) == orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def test_fallback_is_valid_json(monkeypatch):
+    monkeypatch.setattr(json_codec, 'orjson', None)
+
+    def reject(constant):
+        raise ValueError(f'{constant} is not valid json')
+
+    parsed = json.loads(json_codec.dumps(get_values()), parse_constant=reject)
+    assert parsed['not_finite'] == [None, None, None, None, [None, 1.0]]
@@ -0,0 +1,123 @@
+import asyncio
+import socket
+import sqlite3
+import threading
+import time
+
+from aiohttp import web
+import pytest
+
+from stub_services import get_app
+from utils import node_lookup
+from utils.node_lookup import NodeLookupCache, get_search_key, resolve_features
+
+
+def get_free_port():
+    """Get a local port nothing is listening on."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def stub_services():
+    """Serve the stub services on a background thread, returning their url and request stats."""
+    stats = {}
+    app = get_app(latency=0.05, fail_terms=('fail',), stats=stats)
+    port = get_free_port()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{port}', stats
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def lookup(stub_services, tmp_path, monkeypatch):
+    """Point node_lookup at the stub services and an empty cache, returning the stub request stats."""
+    url, stats = stub_services
+    monkeypatch.setattr(node_lookup, 'name_resolver', f'{url}/lookup')
+    monkeypatch.setattr(node_lookup, 'node_norm', f'{url}/get_normalized_nodes')
+    monkeypatch.setattr(node_lookup, 'lookup_cache', NodeLookupCache(str(tmp_path / 'node_lookup.sqlite'), 60))
+    monkeypatch.setattr(node_lookup, 'cache_only', False)
+    monkeypatch.setattr(node_lookup, 'lookup_concurrency', 3)
+    monkeypatch.setattr(node_lookup, 'node_norm_batch_size', 4)
+    node_lookup.lookup_counters.clear()
+    return stats
+
+
+def get_features(search_terms, limit=3):
+    """Get a features yaml with a name lookup for each search term."""
+    return {
+        search_term: {'name_lookup': [{'search_term': search_term, 'limit': limit}]}
+        for search_term in search_terms
+    }
+
+
+def test_concurrency_limit(lookup):
+    resolved = resolve_features(get_features([f'term{k}' for k in range(10)]))
+    assert lookup['lookup_requests'] == 10
+    assert 1 < lookup['max_in_flight'] <= 3
+    assert list(resolved[get_search_key('term0', 3)]) == ['BENCH:term0_0', 'BENCH:term0_1', 'BENCH:term0_2']
+
+
+def test_node_norm_batching(lookup):
+    resolve_features(get_features(['a', 'b', 'c']))
+    # 9 curies in batches of 4
+    assert lookup['norm_requests'] == 3
+    assert lookup['norm_curies'] == 9
+
+
+def test_cache_hits(lookup):
+    features = get_features(['a', 'b'])
+    first = resolve_features(features)
+    requests = (lookup['lookup_requests'], lookup['norm_requests'])
+    second = resolve_features(features)
+    assert second == first
+    assert (lookup['lookup_requests'], lookup['norm_requests']) == requests
+    assert node_lookup.lookup_counters['name_resolver_cache_hits'] == 2
+    assert node_lookup.lookup_counters['node_norm_cache_hits'] == 6
+
+
+def test_cache_ttl(tmp_path):
+    path = str(tmp_path / 'node_lookup.sqlite')
+    cache = NodeLookupCache(path, ttl=60)
+    cache.set_many('endpoint', {'fresh': [1], 'stale': [2]})
+    with cache.connection:
+        cache.connection.execute("UPDATE lookups SET created = ? WHERE key = 'stale'", (time.time() - 120,))
+    assert cache.get_many('endpoint', ['fresh', 'stale']) == {'fresh': [1]}
+
+    # expired entries are evicted when a new connection is opened
+    NodeLookupCache(path, ttl=60).get('endpoint', 'fresh')
+    assert [key for key, in sqlite3.connect(path).execute('SELECT key FROM lookups')] == ['fresh']
+
+    # a ttl of 0 keeps entries forever
+    assert NodeLookupCache(path, ttl=0).get('endpoint', 'fresh') == [1]
+
+
+def test_cache_only(lookup, monkeypatch):
+    cached = resolve_features(get_features(['cached']))
+    requests = (lookup['lookup_requests'], lookup['norm_requests'])
+    monkeypatch.setattr(node_lookup, 'cache_only', True)
+    resolved = resolve_features(get_features(['cached', 'a']))
+    assert resolved == {**cached, get_search_key('a', 3): {}}
+    assert (lookup['lookup_requests'], lookup['norm_requests']) == requests
+
+
+def test_failed_lookup_is_not_cached(lookup):
+    features = get_features(['fail', 'a'])
+    resolved = resolve_features(features)
+    assert resolved[get_search_key('fail', 3)] == {}
+    assert resolved[get_search_key('a', 3)]
+    assert node_lookup.lookup_counters['name_resolver_errors'] == 1
+    assert node_lookup.lookup_cache.get(node_lookup.name_resolver, get_search_key('fail', 3)) is None
+
+    # the failed search is retried on the next run
+    resolve_features(features)
+    assert lookup['lookup_requests'] == 3
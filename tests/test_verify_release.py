@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from utils.release_index import ReleaseIndex, build_release_index
+from verify_release import DIFFERENT_PREDICATE, EDGE_MISSING, check_test_edge
+
+
+@pytest.fixture
+def release_index(tmp_path):
+    """Index a release with one edge of each kind, written one way round like main.py does."""
+    edges = [
+        {'subject': 'A:1', 'predicate': 'biolink:correlated_with', 'object': 'B:1'},
+        {'subject': 'A:2', 'predicate': 'biolink:positively_correlated_with', 'object': 'B:2'},
+        {'subject': 'A:3', 'predicate': 'biolink:affects', 'object': 'B:3'},
+    ]
+    nodes = [{'id': f'{prefix}:{k}', 'category': [f'biolink:{prefix}']} for prefix in 'AB' for k in range(1, 4)]
+    for name, lines in [('edges.jsonl', edges), ('nodes.jsonl', nodes)]:
+        (tmp_path / name).write_text(''.join(f'{json.dumps(line)}\n' for line in lines))
+    build_release_index(str(tmp_path), 'edges.jsonl', 'nodes.jsonl', str(tmp_path / 'index.sqlite'))
+    return ReleaseIndex(str(tmp_path / 'index.sqlite'))
+
+
+def get_test_edge(subject, predicate, object_id, **categories):
+    """Get an SRI test edge."""
+    return {'subject': subject, 'predicate': predicate, 'object': object_id, **categories}
+
+
+def test_found_both_ways(release_index):
+    assert check_test_edge(release_index, get_test_edge('A:1', 'biolink:correlated_with', 'B:1', subject_category='biolink:A')) is None
+    assert check_test_edge(release_index, get_test_edge('B:1', 'biolink:correlated_with', 'A:1', object_category='biolink:A')) is None
+    assert check_test_edge(release_index, get_test_edge('B:2', 'biolink:positively_correlated_with', 'A:2')) is None
+
+
+def test_asymmetric_predicate_keeps_its_direction(release_index):
+    assert check_test_edge(release_index, get_test_edge('A:3', 'biolink:affects', 'B:3')) is None
+    assert check_test_edge(release_index, get_test_edge('B:3', 'biolink:affects', 'A:3')) == EDGE_MISSING
+
+
+def test_different_predicate(release_index):
+    reason = check_test_edge(release_index, get_test_edge('B:2', 'biolink:has_real_world_evidence_of_association_with', 'A:2'))
+    assert reason == f'{DIFFERENT_PREDICATE} (biolink:positively_correlated_with)'
+
+
+def test_missing_and_wrong_category(release_index):
+    assert check_test_edge(release_index, get_test_edge('A:1', 'biolink:correlated_with', 'B:2')) == EDGE_MISSING
+    assert check_test_edge(release_index, get_test_edge('A:1', 'biolink:correlated_with', 'B:1', object_category='biolink:A')) == "object B:1 isn't a biolink:A"